@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+bench_ingest.py
+Benchmark parser throughput and end-to-end ingest.py performance per format
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+INGEST = os.path.join(SRC_DIR, "ingest.py")
+
+# Extra ingest.py flags for each benchmarked write mode
+MODES = {
+    "default": [],
+    "defer-fts": ["--defer-fts"],
+    "bulk": ["--bulk", "--defer-fts"],
+    "compress": ["--bulk", "--defer-fts", "--compress"],
+}
+
+
+def run_child(cmd: List[str]) -> Tuple[float, Optional[float], str]:
+    """
+    Run a command, returning (wall seconds, peak RSS in MB, stdout).
+
+    Peak RSS comes from the child's own rusage, so runs don't pollute each
+    other; it is None where os.wait4 is unavailable (Windows).
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if not hasattr(os, "wait4"):
+        out, err = proc.communicate()
+        elapsed = time.perf_counter() - start
+        if proc.returncode:
+            raise SystemExit(f"[ERROR] {' '.join(cmd)} failed:\n{err}")
+        return elapsed, None, out
+
+    # Drain output before reaping so a chatty child can't block on a full pipe
+    out = proc.stdout.read()
+    err = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+    if proc.returncode:
+        raise SystemExit(f"[ERROR] {' '.join(cmd)} failed:\n{err}")
+    # ru_maxrss is KB on Linux, bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return elapsed, usage.ru_maxrss / divisor, out
+
+
+def parse_only(fmt: str, path: str):
+    """Child mode: drain a parser and print counts as JSON."""
+    sys.path.insert(0, SRC_DIR)
+    from ingest import PARSERS
+
+    messages = 0
+    threads = set()
+    start = time.perf_counter()
+    for msg in PARSERS[fmt].parse(path):
+        messages += 1
+        threads.add(msg["thread_id"])
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"messages": messages, "threads": len(threads), "seconds": elapsed}))
+
+
+def db_size_mb(db_path: str) -> float:
+    """Size of a database including its WAL and shared-memory files."""
+    total = 0
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            total += os.path.getsize(db_path + suffix)
+    return total / 1e6
+
+
+def count_messages(db_path: str) -> int:
+    import sqlite3
+    con = sqlite3.connect(db_path)
+    count = con.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    con.close()
+    return count
+
+
+def bench_parse(fmt: str, path: str) -> Dict:
+    """Parser throughput in a fresh process."""
+    _, rss, out = run_child([sys.executable, os.path.abspath(__file__), "--parse-only", fmt, path])
+    counts = json.loads(out)
+    return {
+        "benchmark": "parse",
+        "mode": "-",
+        "messages": counts["messages"],
+        "seconds": round(counts["seconds"], 4),
+        "rate": round(counts["messages"] / counts["seconds"], 1) if counts["seconds"] else None,
+        "peak_rss_mb": round(rss, 1) if rss is not None else None,
+    }
+
+
+def bench_ingest(fmt: str, path: str, mode: str, workdir: str) -> List[Dict]:
+    """End-to-end ingest into a fresh database, then an unchanged re-import."""
+    db_path = os.path.join(workdir, f"{fmt}_{mode}.sqlite")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    cmd = [sys.executable, INGEST, "--in", path, "--db", db_path, "--format", fmt] + MODES[mode]
+    results = []
+    for benchmark in ("ingest", "reimport"):
+        seconds, rss, _ = run_child(cmd)
+        messages = count_messages(db_path)
+        results.append({
+            "benchmark": benchmark,
+            "mode": mode,
+            "messages": messages,
+            "seconds": round(seconds, 4),
+            "rate": round(messages / seconds, 1) if seconds else None,
+            "peak_rss_mb": round(rss, 1) if rss is not None else None,
+            "db_mb": round(db_size_mb(db_path), 2),
+        })
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline_path: str):
+    """Print rate ratios against an earlier results file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["format"], r["benchmark"], r["mode"]): r for r in baseline["results"]}
+
+    print(f"\n[*] Compared with {baseline_path} ({baseline['meta'].get('git_revision') or 'unknown revision'})")
+    print(f"{'Format':<10} {'Benchmark':<10} {'Mode':<10} {'Old rate':>12} {'New rate':>12} {'Ratio':>7}")
+    print("-" * 66)
+    for r in results:
+        prev = old.get((r["format"], r["benchmark"], r["mode"]))
+        if not prev or not prev.get("rate") or not r.get("rate"):
+            continue
+        print(f"{r['format']:<10} {r['benchmark']:<10} {r['mode']:<10} "
+              f"{prev['rate']:>12,.0f} {r['rate']:>12,.0f} {r['rate'] / prev['rate']:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark parse throughput and ingest.py rows/sec, peak RSS and DB size",
+        epilog="Example: python benchmarks/bench_ingest.py --data bench_data --output results.json"
+    )
+    parser.add_argument("--data", default="bench_data",
+                        help="Directory of synthetic_<format>.json files (see generate_exports.py)")
+    parser.add_argument("--modes", default="default,bulk",
+                        help=f"Comma-separated ingest modes: {', '.join(MODES)}")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--compare", help="Earlier results JSON to compare rates against")
+    parser.add_argument("--parse-only", nargs=2, metavar=("FORMAT", "PATH"), help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.parse_only:
+        parse_only(*args.parse_only)
+        return
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"unknown mode(s): {', '.join(unknown)}")
+
+    inputs = []
+    for fmt in ("chatgpt", "anthropic", "grok"):
+        path = os.path.join(args.data, f"synthetic_{fmt}.json")
+        if os.path.exists(path):
+            inputs.append((fmt, path))
+    if not inputs:
+        raise SystemExit(f"[ERROR] No synthetic_<format>.json files in {args.data}; "
+                         f"run benchmarks/generate_exports.py first")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_ingest_") as workdir:
+        for fmt, path in inputs:
+            input_mb = round(os.path.getsize(path) / 1e6, 2)
+            print(f"[*] {fmt}: {path} ({input_mb} MB)")
+            runs = [bench_parse(fmt, path)]
+            for mode in modes:
+                runs.extend(bench_ingest(fmt, path, mode, workdir))
+            for run in runs:
+                run.update({"format": fmt, "input_mb": input_mb})
+                rss = f"{run['peak_rss_mb']} MB" if run["peak_rss_mb"] is not None else "n/a"
+                db = f", db {run['db_mb']} MB" if "db_mb" in run else ""
+                print(f"  [+] {run['benchmark']:<8} {run['mode']:<10} {run['messages']} msgs "
+                      f"in {run['seconds']:.2f}s ({run['rate'] or 0:,.0f}/s), peak RSS {rss}{db}")
+            results.extend(runs)
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[+] Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+generate_exports.py
+Generate synthetic ChatGPT, Anthropic and Grok exports for benchmarking
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import uuid
+from typing import Dict, Iterator, List
+
+WORDS = (
+    "the a model data query index thread message archive context vector search "
+    "python sqlite export stream batch token embedding parser function result "
+    "error value table memory cache latency throughput commit schema import "
+    "because however therefore example should could would might always never"
+).split()
+
+CODE_LINES = [
+    "def handler(event, context):",
+    "    rows = cur.execute(query, params).fetchall()",
+    "    for row in rows:",
+    "        total += row['amount']",
+    "    return {'status': 200, 'total': total}",
+    "SELECT title, COUNT(*) FROM messages GROUP BY canonical_thread_id;",
+]
+
+BASE_EPOCH = 1700000000
+
+
+def make_text(rng: random.Random, content: str, role: str) -> str:
+    """Random message body; 'long' assistant replies include prose and a code block."""
+    if content == "mixed":
+        content = rng.choice(["short", "short", "long"])
+    if content == "short" or role == "user":
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))).capitalize() + "?"
+    paragraphs = []
+    for _ in range(rng.randint(2, 6)):
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + ".")
+    if rng.random() < 0.5:
+        block = "\n".join(rng.choice(CODE_LINES) for _ in range(rng.randint(4, 30)))
+        paragraphs.append(f"```python\n{block}\n```")
+    return "\n\n".join(paragraphs)
+
+
+def iso(epoch: float) -> str:
+    """ISO timestamp in the style used by Anthropic and Grok exports."""
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def conversation_turns(rng: random.Random, index: int, args) -> List[Dict]:
+    """Alternating user/assistant turns for one conversation."""
+    low = max(1, args.messages // 2)
+    high = max(low, args.messages * 3 // 2)
+    start = BASE_EPOCH + index * 3600
+    turns = []
+    for i in range(rng.randint(low, high)):
+        role = "user" if i % 2 == 0 else "assistant"
+        turns.append({"role": role, "text": make_text(rng, args.content, role), "ts": start + i * 7})
+    return turns
+
+
+def chatgpt_conversation(rng: random.Random, index: int, args) -> Dict:
+    """ChatGPT conversation with a mapping tree; branch_rate adds regenerated answers."""
+    conv_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    mapping = {"client-created-root": {"id": "client-created-root", "message": None,
+                                       "parent": None, "children": []}}
+    parent = "client-created-root"
+    turns = conversation_turns(rng, index, args)
+    for n, turn in enumerate(turns):
+        node_id = f"{conv_id}-{n}"
+        # Abandoned regeneration hanging off the same parent, possibly a few levels deep
+        if turn["role"] == "assistant" and rng.random() < args.branch_rate:
+            alt_parent = parent
+            for depth in range(rng.randint(1, 3)):
+                alt_id = f"{node_id}-alt{depth}"
+                role = "assistant" if depth % 2 == 0 else "user"
+                mapping[alt_id] = {
+                    "id": alt_id, "parent": alt_parent, "children": [],
+                    "message": {"id": alt_id, "author": {"role": role},
+                                "content": {"content_type": "text",
+                                            "parts": [make_text(rng, args.content, role)]},
+                                "create_time": turn["ts"] - 3 + depth},
+                }
+                mapping[alt_parent]["children"].append(alt_id)
+                alt_parent = alt_id
+        mapping[node_id] = {
+            "id": node_id, "parent": parent, "children": [],
+            "message": {"id": node_id, "author": {"role": turn["role"]},
+                        "content": {"content_type": "text", "parts": [turn["text"]]},
+                        "create_time": turn["ts"]},
+        }
+        mapping[parent]["children"].append(node_id)
+        parent = node_id
+    return {
+        "id": conv_id,
+        "title": f"Synthetic conversation {index}",
+        "create_time": turns[0]["ts"],
+        "update_time": turns[-1]["ts"],
+        "mapping": mapping,
+        "current_node": parent,
+    }
+
+
+def anthropic_conversation(rng: random.Random, index: int, args) -> Dict:
+    """Anthropic conversation with a flat chat_messages list."""
+    turns = conversation_turns(rng, index, args)
+    messages = []
+    for turn in turns:
+        messages.append({
+            "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+            "text": turn["text"],
+            "content": [{"type": "text", "text": turn["text"]}],
+            "sender": "human" if turn["role"] == "user" else "assistant",
+            "created_at": iso(turn["ts"]),
+            "updated_at": iso(turn["ts"]),
+            "attachments": [],
+            "files": [],
+        })
+    return {
+        "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+        "name": f"Synthetic conversation {index}",
+        "created_at": iso(turns[0]["ts"]),
+        "updated_at": iso(turns[-1]["ts"]),
+        "chat_messages": messages,
+    }
+
+
+def grok_conversation(rng: random.Random, index: int, args) -> Dict:
+    """Grok conversation wrapper with MongoDB-style timestamps."""
+    conv_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    turns = conversation_turns(rng, index, args)
+    responses = []
+    for n, turn in enumerate(turns):
+        responses.append({"response": {
+            "_id": f"{conv_id}-{n}",
+            "conversation_id": conv_id,
+            "message": turn["text"],
+            "sender": "human" if turn["role"] == "user" else "assistant",
+            "create_time": {"$date": {"$numberLong": str(int(turn["ts"] * 1000))}},
+            "model": "grok-3",
+        }})
+    return {
+        "conversation": {
+            "id": conv_id,
+            "title": f"Synthetic conversation {index}",
+            "create_time": iso(turns[0]["ts"]),
+            "modify_time": iso(turns[-1]["ts"]),
+        },
+        "responses": responses,
+    }
+
+
+GENERATORS = {
+    "chatgpt": chatgpt_conversation,
+    "anthropic": anthropic_conversation,
+    "grok": grok_conversation,
+}
+
+
+def iter_conversations(fmt: str, args) -> Iterator[Dict]:
+    """Yield conversations one at a time so huge exports never sit in memory."""
+    rng = random.Random(f"{args.seed}-{fmt}")
+    make = GENERATORS[fmt]
+    for index in range(args.conversations):
+        yield make(rng, index, args)
+
+
+def write_export(fmt: str, path: str, args) -> int:
+    """Stream one export file to disk; returns its size in bytes."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"conversations": [' if fmt == "grok" else "[")
+        for i, convo in enumerate(iter_conversations(fmt, args)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(convo))
+        f.write("]}" if fmt == "grok" else "]")
+    return os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic LLM chat exports for benchmarking",
+        epilog="Example: python benchmarks/generate_exports.py --format all --conversations 1000 --out bench_data"
+    )
+    parser.add_argument("--format", choices=list(GENERATORS) + ["all"], default="all",
+                        help="Export format to generate (default: all)")
+    parser.add_argument("--conversations", type=int, default=1000, help="Conversations per export")
+    parser.add_argument("--messages", type=int, default=20,
+                        help="Average messages per conversation (varies +/- 50%%)")
+    parser.add_argument("--content", choices=["short", "long", "mixed"], default="mixed",
+                        help="Message length profile")
+    parser.add_argument("--branch-rate", type=float, default=0.1,
+                        help="ChatGPT: chance an assistant turn gets an abandoned regeneration branch")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (output is deterministic)")
+    parser.add_argument("--out", default="bench_data", help="Output directory")
+
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+
+    formats = list(GENERATORS) if args.format == "all" else [args.format]
+    for fmt in formats:
+        path = os.path.join(args.out, f"synthetic_{fmt}.json")
+        size = write_export(fmt, path, args)
+        print(f"[+] {fmt}: {path} ({args.conversations} conversations, {size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
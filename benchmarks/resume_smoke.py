@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+resume_smoke.py
+Interrupt an ingest.py run after a committed checkpoint, finish it with --resume, and compare with a clean run
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+INGEST = os.path.join(SRC_DIR, "ingest.py")
+
+# Exit code of the interrupted child, so a run that finished early is told apart
+INTERRUPTED = 3
+
+
+def archive_state(db_path: str) -> Dict:
+    """Every message ID, plus thread and FTS counts and integrity, across every shard."""
+    sys.path.insert(0, SRC_DIR)
+    import shards
+
+    con, paths = shards.open_archive(db_path)
+    state = {"message_ids": [], "threads": 0, "fts_docids": 0, "integrity": []}
+    for schema in shards.iter_attached(con, paths):
+        state["message_ids"] += [row[0] for row in con.execute(f"SELECT message_id FROM {schema}.messages")]
+        state["threads"] += con.execute(f"SELECT count(*) FROM {schema}.threads").fetchone()[0]
+        state["fts_docids"] += con.execute(f"SELECT count(*) FROM {schema}.messages_fts_docids").fetchone()[0]
+        state["integrity"].append(con.execute(f"PRAGMA {schema}.integrity_check").fetchone()[0])
+    con.close()
+    state["message_ids"].sort()
+    return state
+
+
+def interrupted_ingest(after: int, chunk: int, argv: List[str]):
+    """Child mode: run ingest.py in-process and exit abruptly once `after` checkpoints are committed."""
+    sys.path.insert(0, SRC_DIR)
+    import ingest
+
+    # Small write events and immediate bulk commits, so small exports still checkpoint often
+    ingest.EVENT_CHUNK_MESSAGES = chunk
+    ingest.BULK_CHECKPOINT_SECONDS = 0
+    save_checkpoint = ingest.save_checkpoint
+    saved = 0
+
+    def save_or_die(cur, job, threads_done, byte_offset):
+        nonlocal saved
+        # The previous checkpoint's transaction has been committed by now;
+        # exit like a kill, with no cleanup and the current one uncommitted
+        if saved >= after:
+            sys.stdout.flush()
+            os._exit(INTERRUPTED)
+        save_checkpoint(cur, job, threads_done, byte_offset)
+        saved += 1
+
+    ingest.save_checkpoint = save_or_die
+    sys.argv = [INGEST] + argv
+    ingest.main()
+
+
+def ingest_cmd(data: str, db_path: str, flags: List[str]) -> List[str]:
+    return [sys.executable, INGEST, "--in", data, "--db", db_path] + flags
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that an interrupted ingest.py run finished with --resume matches a clean run",
+        epilog="Example: python benchmarks/resume_smoke.py --data bench_data --bulk"
+    )
+    parser.add_argument("--data", default="bench_data",
+                        help="Export file or directory to ingest (see generate_exports.py)")
+    parser.add_argument("--after", type=int, default=3,
+                        help="Interrupt once this many checkpoints are committed (default: 3)")
+    parser.add_argument("--chunk", type=int, default=100,
+                        help="Messages per write event in the interrupted run (default: 100)")
+    parser.add_argument("--bulk", action="store_true", help="Run both imports with --bulk")
+    parser.add_argument("--shard-by", dest="shard_by", choices=("platform", "year"),
+                        help="Ingest into a sharded archive")
+    parser.add_argument("--workdir", help="Keep the archives and logs here instead of a temp directory")
+    parser.add_argument("--interrupt", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.interrupt is not None:
+        interrupted_ingest(args.after, args.chunk, args.interrupt)
+        return
+
+    if not os.path.exists(args.data):
+        raise SystemExit(f"[ERROR] {args.data} not found; run benchmarks/generate_exports.py first")
+    if args.after < 1 or args.chunk < 1:
+        parser.error("--after and --chunk must be >= 1")
+
+    flags = ["--bulk"] if args.bulk else []
+    if args.shard_by:
+        flags += ["--shard-by", args.shard_by]
+
+    with tempfile.TemporaryDirectory(prefix="resume_smoke_") as tmp:
+        workdir = args.workdir or tmp
+        for name in ("clean", "resumed"):
+            shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+        os.makedirs(workdir, exist_ok=True)
+
+        print(f"[*] Clean ingest of {args.data}")
+        clean_db = os.path.join(workdir, "clean", "archive.sqlite")
+        subprocess.run(ingest_cmd(args.data, clean_db, flags), stdout=subprocess.DEVNULL, check=True)
+        clean = archive_state(clean_db)
+        print(f"  [+] {len(clean['message_ids'])} messages, {clean['threads']} threads")
+
+        db_path = os.path.join(workdir, "resumed", "archive.sqlite")
+        print(f"[*] Interrupting an ingest after {args.after} checkpoint(s)")
+        cmd = [sys.executable, os.path.abspath(__file__), "--after", str(args.after),
+               "--chunk", str(args.chunk), "--interrupt"] + ingest_cmd(args.data, db_path, flags)[2:]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL)
+        if proc.returncode != INTERRUPTED:
+            raise SystemExit(f"[ERROR] Interrupted ingest exited with code {proc.returncode}; "
+                             f"the export may be too small for {args.after} checkpoints of {args.chunk} messages")
+        partial = len(archive_state(db_path)["message_ids"])
+        print(f"  [+] {partial} messages committed before the interruption")
+
+        print("[*] Finishing with --resume")
+        stats_path = os.path.join(workdir, "resume.json")
+        out = subprocess.run(ingest_cmd(args.data, db_path, flags + ["--resume", "--stats-json", stats_path]),
+                             stdout=subprocess.PIPE, text=True, check=True).stdout
+        with open(stats_path, encoding="utf-8") as f:
+            totals = json.load(f)["totals"]
+        resumed = archive_state(db_path)
+
+        failures = []
+        if "Resuming" not in out:
+            failures.append("--resume did not pick up the interrupted import")
+        if not totals["threads_resumed"]:
+            failures.append("no threads were fast-forwarded")
+        # Checkpoints only cover committed threads, so nothing before them is re-inserted
+        if totals["duplicates"]:
+            failures.append(f"{totals['duplicates']} messages re-read past the checkpoint were duplicates")
+        if resumed["message_ids"] != clean["message_ids"]:
+            missing = len(set(clean["message_ids"]) - set(resumed["message_ids"]))
+            extra = len(set(resumed["message_ids"]) - set(clean["message_ids"]))
+            failures.append(f"message set differs from a clean run: {missing} missing, {extra} extra")
+        for key in ("threads", "fts_docids"):
+            if resumed[key] != clean[key]:
+                failures.append(f"{key}: expected {clean[key]}, got {resumed[key]}")
+        bad = [result for result in resumed["integrity"] if result != "ok"]
+        if bad:
+            failures.append(f"integrity_check: {bad[0]}")
+
+        if failures:
+            raise SystemExit("[ERROR] Resume smoke test failed:\n  " + "\n  ".join(failures))
+        print(f"[+] Resumed past {totals['threads_resumed']} threads ({totals['messages_resumed']} messages); "
+              f"{len(resumed['message_ids'])} messages match a clean run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+stress_concurrency.py
+Run several ingest.py processes and readers against one archive at once, then check the result
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+INGEST = os.path.join(SRC_DIR, "ingest.py")
+
+# Common word in generate_exports.py output, used for reader and FTS checks
+SEARCH_TERM = "sqlite"
+
+
+def archive_counts(db_path: str) -> Dict:
+    """Messages, threads, FTS docids, FTS matches and integrity across every shard."""
+    sys.path.insert(0, SRC_DIR)
+    import shards
+
+    con, paths = shards.open_archive(db_path)
+    counts = {"messages": 0, "threads": 0, "fts_docids": 0, "fts_matches": 0, "accounts": {}, "integrity": []}
+    for schema in shards.iter_attached(con, paths):
+        counts["messages"] += con.execute(f"SELECT count(*) FROM {schema}.messages").fetchone()[0]
+        counts["threads"] += con.execute(f"SELECT count(*) FROM {schema}.threads").fetchone()[0]
+        counts["fts_docids"] += con.execute(f"SELECT count(*) FROM {schema}.messages_fts_docids").fetchone()[0]
+        counts["fts_matches"] += con.execute(f"SELECT count(*) FROM {schema}.messages_fts WHERE messages_fts MATCH ?",
+                                             (SEARCH_TERM,)).fetchone()[0]
+        for account, n in con.execute(f"SELECT account_id, count(*) FROM {schema}.messages GROUP BY account_id"):
+            counts["accounts"][account] = counts["accounts"].get(account, 0) + n
+        counts["integrity"].append(con.execute(f"PRAGMA {schema}.integrity_check").fetchone()[0])
+    con.close()
+    return counts
+
+
+def reader(db_path: str, stop_path: str):
+    """Child mode: query the archive until stop_path appears, then print a JSON summary."""
+    sys.path.insert(0, SRC_DIR)
+    import shards
+    from ingest import BUSY_TIMEOUT
+
+    queries = errors = 0
+    last_count = 0
+    first_error = None
+    while not os.path.exists(stop_path):
+        try:
+            con, paths = shards.open_archive(db_path, BUSY_TIMEOUT)
+            count = shards.message_count(con, paths)
+            if count < last_count:
+                raise AssertionError(f"message count went backwards: {last_count} -> {count}")
+            last_count = count
+            shards.search(con, paths, SEARCH_TERM, limit=20, order="rank")
+            shards.list_threads(con, paths, limit=20)
+            con.close()
+            queries += 1
+        except SystemExit as e:
+            # The archive doesn't exist until the first writer creates it
+            if "not found" not in str(e):
+                errors += 1
+                first_error = first_error or str(e)
+            time.sleep(0.05)
+        except Exception as e:
+            errors += 1
+            first_error = first_error or f"{type(e).__name__}: {e}"
+    print(json.dumps({"queries": queries, "errors": errors, "last_count": last_count,
+                      "first_error": first_error}))
+
+
+def ingest_cmd(data: str, db_path: str, flags: List[str], account: str) -> List[str]:
+    return [sys.executable, INGEST, "--in", data, "--db", db_path, "--account", account] + flags
+
+
+def log_tail(path: str, lines: int = 15) -> str:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stress-test concurrent ingest.py writers and archive readers on one database",
+        epilog="Example: python benchmarks/stress_concurrency.py --data bench_data --writers 4 --readers 2"
+    )
+    parser.add_argument("--data", default="bench_data",
+                        help="Export file or directory to ingest (see generate_exports.py)")
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent ingest.py processes")
+    parser.add_argument("--readers", type=int, default=2, help="Concurrent reader processes")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Run the writers with --bulk --defer-fts (they take turns holding the lock)")
+    parser.add_argument("--shard-by", dest="shard_by", choices=("platform", "year"),
+                        help="Ingest into a sharded archive")
+    parser.add_argument("--busy-timeout", dest="busy_timeout", type=float, default=None,
+                        help="Passed through to ingest.py")
+    parser.add_argument("--workdir", help="Keep the archive and logs here instead of a temp directory")
+    parser.add_argument("--read", nargs=2, metavar=("DB", "STOP_FILE"), help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.read:
+        reader(*args.read)
+        return
+
+    if not os.path.exists(args.data):
+        raise SystemExit(f"[ERROR] {args.data} not found; run benchmarks/generate_exports.py first")
+    if args.writers < 1 or args.readers < 0:
+        parser.error("--writers must be >= 1 and --readers >= 0")
+
+    flags = ["--bulk", "--defer-fts"] if args.bulk else []
+    if args.shard_by:
+        flags += ["--shard-by", args.shard_by]
+    if args.busy_timeout is not None:
+        flags += ["--busy-timeout", str(args.busy_timeout)]
+
+    with tempfile.TemporaryDirectory(prefix="stress_concurrency_") as tmp:
+        workdir = args.workdir or tmp
+        # Start from empty archives so every writer really inserts
+        for name in ("reference", "shared"):
+            shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+        os.makedirs(workdir, exist_ok=True)
+
+        # What one writer produces on its own
+        reference_db = os.path.join(workdir, "reference", "archive.sqlite")
+        print(f"[*] Reference ingest of {args.data}")
+        subprocess.run(ingest_cmd(args.data, reference_db, flags, "reference"),
+                       stdout=subprocess.DEVNULL, check=True)
+        reference = archive_counts(reference_db)
+        print(f"  [+] {reference['messages']} messages, {reference['threads']} threads per writer")
+
+        db_path = os.path.join(workdir, "shared", "archive.sqlite")
+        stop_path = os.path.join(workdir, "stop")
+        if os.path.exists(stop_path):
+            os.remove(stop_path)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        print(f"[*] Starting {args.writers} writer(s) and {args.readers} reader(s) on {db_path}")
+        readers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--read", db_path, stop_path],
+                                    stdout=subprocess.PIPE, text=True)
+                   for _ in range(args.readers)]
+        writers = []
+        start = time.perf_counter()
+        for i in range(args.writers):
+            log_path = os.path.join(workdir, f"writer{i}.log")
+            stats_path = os.path.join(workdir, f"writer{i}.json")
+            cmd = ingest_cmd(args.data, db_path, flags + ["--concurrent", "--stats-json", stats_path],
+                             f"writer{i}")
+            with open(log_path, "w", encoding="utf-8") as log:
+                writers.append((subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT),
+                                log_path, stats_path))
+
+        failures = []
+        lock_seconds = 0.0
+        for i, (proc, log_path, stats_path) in enumerate(writers):
+            if proc.wait():
+                failures.append(f"writer{i} exited with code {proc.returncode}:\n{log_tail(log_path)}")
+            elif os.path.exists(stats_path):
+                with open(stats_path, encoding="utf-8") as f:
+                    lock_seconds += json.load(f)["totals"]["lock_seconds"]
+        elapsed = time.perf_counter() - start
+
+        open(stop_path, "w").close()
+        for i, proc in enumerate(readers):
+            out, _ = proc.communicate()
+            if proc.returncode:
+                failures.append(f"reader{i} exited with code {proc.returncode}")
+                continue
+            result = json.loads(out)
+            print(f"  [+] reader{i}: {result['queries']} queries, {result['errors']} errors")
+            if result["errors"]:
+                failures.append(f"reader{i} failed {result['errors']} queries, first: {result['first_error']}")
+        print(f"  [+] Writers finished in {elapsed:.2f}s, {lock_seconds:.2f}s waiting for locks")
+
+        counts = archive_counts(db_path)
+        expected = {key: reference[key] * args.writers
+                    for key in ("messages", "threads", "fts_docids", "fts_matches")}
+        for key, value in expected.items():
+            if counts[key] != value:
+                failures.append(f"{key}: expected {value}, got {counts[key]}")
+        for i in range(args.writers):
+            got = counts["accounts"].get(f"writer{i}", 0)
+            if got != reference["messages"]:
+                failures.append(f"writer{i}: expected {reference['messages']} messages, got {got}")
+        bad = [result for result in counts["integrity"] if result != "ok"]
+        if bad:
+            failures.append(f"integrity_check: {bad[0]}")
+
+        if failures:
+            raise SystemExit("[ERROR] Concurrency stress test failed:\n  " + "\n  ".join(failures))
+        print(f"[+] {counts['messages']} messages from {args.writers} writers, "
+              f"FTS and integrity checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+compress_archive.py
+Compress the message text of an existing archive with a trained zstd dictionary
+"""
+
+import argparse
+import os
+import compression
+import shards
+from ingest import begin, connect, ensure_schema
+
+
+def compress_database(db_path: str, retrain: bool, vacuum: bool):
+    """Train a dictionary on one database's text (if needed) and compress its plain rows."""
+    con = connect(db_path)
+    cur = con.cursor()
+    before_size = os.path.getsize(db_path)
+
+    begin(con)
+    codec = compression.load_codec(cur, train=True)
+    if retrain or codec.training:
+        samples = compression.sample_archive(cur, codec)
+        codec.samples = samples
+        dict_id = codec.train(cur)
+        print(f"  [+] Trained dictionary {dict_id} on {len(samples)} messages" if dict_id
+              else "  [!] Too little text to train a dictionary; compressing without one")
+    elif codec.dicts:
+        print(f"  [*] Using dictionary {max(codec.dicts)}")
+
+    for table in ("messages", "bodies"):
+        count, raw, stored = compression.compress_rows_in_place(cur, codec, table=table)
+        if count or table == "messages":
+            print(f"  [+] Compressed {count} {table} ({raw / 1e6:,.1f} MB -> {stored / 1e6:,.1f} MB)")
+    con.commit()
+
+    if vacuum:
+        print(f"  [*] Vacuuming...")
+        con.execute("VACUUM")
+        print(f"  [+] File size: {before_size / 1e6:,.1f} MB -> {os.path.getsize(db_path) / 1e6:,.1f} MB")
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compress message text in an existing archive (sharded archives: every shard)",
+        epilog="Example: python src/compress_archive.py --db archive.sqlite --vacuum"
+    )
+    parser.add_argument("--db", required=True, help="Path to SQLite database")
+    parser.add_argument("--retrain", action="store_true",
+                        help="Train a new dictionary even if one exists (older rows stay readable)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="VACUUM afterwards so the file actually shrinks")
+
+    args = parser.parse_args()
+    compression.require_zstandard()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"[ERROR] Database not found: {args.db}")
+    ensure_schema(args.db)
+
+    con = connect(args.db)
+    _, layout = shards.load_layout(con)
+    con.close()
+
+    for path in list(layout.values()) or [args.db]:
+        print(f"[*] {path}")
+        compress_database(path, args.retrain, args.vacuum)
+
+    print("\n[+] Complete!")
+
+
+if __name__ == "__main__":
+    main()
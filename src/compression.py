@@ -0,0 +1,254 @@
+# compression.py
+# Optional zstd compression of messages.text with dictionaries trained on
+# the archive itself. Compressed bodies are stored as BLOBs in the same
+# column, so plain and compressed rows can live side by side; readers call
+# plain_text() (or the plain_text() SQL function) to get the string back.
+
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, only needed for --compress
+    zstandard = None
+
+LEVEL = 3
+DICT_SIZE = 112 * 1024
+# Plaintext gathered before training a dictionary from incoming messages
+TRAIN_BYTES = 4 * 1024 * 1024
+TRAIN_MIN_SAMPLES = 1000
+# Shorter bodies gain too little to be worth a frame header
+MIN_COMPRESS_BYTES = 64
+# Index of the text column in ingest.INSERT_MSG rows
+TEXT_COLUMN = 6
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise SystemExit("[ERROR] Compressed text needs the zstandard package: pip install zstandard")
+
+
+def ensure_dict_table(cur):
+    """Create the table holding trained dictionaries."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS text_dicts (
+          dict_id INTEGER PRIMARY KEY,
+          created_at TEXT NOT NULL,
+          samples INTEGER NOT NULL,
+          data BLOB NOT NULL
+        )
+    """)
+
+
+class TextCodec:
+    """
+    Compresses with the newest dictionary and decompresses any frame.
+
+    Frames record the ID of the dictionary they were made with (0 for
+    none), so older rows stay readable after a new dictionary is trained.
+    With train=True and no dictionary yet, the first TRAIN_BYTES of
+    plaintext passed to observe() are kept as samples and a dictionary is
+    trained (and saved) as soon as there are enough of them.
+    """
+
+    def __init__(self, dicts: Dict[int, bytes], train: bool = False, level: int = LEVEL):
+        require_zstandard()
+        self.level = level
+        self.dicts = {dict_id: zstandard.ZstdCompressionDict(data) for dict_id, data in dicts.items()}
+        self.decompressors = {}
+        self.samples: Optional[List[bytes]] = [] if train and not dicts else None
+        self.sample_bytes = 0
+        # Sizes of the bodies passed through compress(), for reporting
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compressor = None
+        if self.dicts:
+            self.compressor = zstandard.ZstdCompressor(level=level, dict_data=self.dicts[max(self.dicts)])
+
+    @property
+    def training(self) -> bool:
+        return self.samples is not None
+
+    def compress(self, text: str) -> Union[str, bytes]:
+        """Compressed bytes, or text unchanged when compressing doesn't pay."""
+        if self.compressor is None:
+            return text
+        raw = text.encode("utf-8")
+        self.raw_bytes += len(raw)
+        if len(raw) >= MIN_COMPRESS_BYTES:
+            blob = self.compressor.compress(raw)
+            if len(blob) < len(raw):
+                self.stored_bytes += len(blob)
+                return blob
+        self.stored_bytes += len(raw)
+        return text
+
+    def decompress(self, value: Union[str, bytes, None]) -> Optional[str]:
+        if not isinstance(value, bytes):
+            return value
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        dctx = self.decompressors.get(dict_id)
+        if dctx is None:
+            if dict_id and dict_id not in self.dicts:
+                raise SystemExit(f"[ERROR] Compressed text needs dictionary {dict_id}, "
+                                 f"which is missing from text_dicts")
+            dctx = zstandard.ZstdDecompressor(dict_data=self.dicts.get(dict_id))
+            self.decompressors[dict_id] = dctx
+        return dctx.decompress(value).decode("utf-8")
+
+    def compress_rows(self, rows: List[Tuple]) -> List[Tuple]:
+        """Rows with their text column compressed (unchanged until a compressor exists)."""
+        if self.compressor is None:
+            return rows
+        out = []
+        for row in rows:
+            text = self.compress(row[TEXT_COLUMN])
+            if text is row[TEXT_COLUMN]:
+                out.append(row)
+            else:
+                out.append(row[:TEXT_COLUMN] + (text,) + row[TEXT_COLUMN + 1:])
+        return out
+
+    def observe(self, cur, rows: List[Tuple]):
+        """Collect training samples from rows about to be written; no-op once trained."""
+        if not self.training:
+            return
+        for row in rows:
+            raw = row[TEXT_COLUMN].encode("utf-8")
+            if raw:
+                self.samples.append(raw)
+                self.sample_bytes += len(raw)
+        if self.sample_bytes >= TRAIN_BYTES and len(self.samples) >= TRAIN_MIN_SAMPLES:
+            self.train(cur)
+
+    def train(self, cur) -> Optional[int]:
+        """
+        Train a dictionary from the collected samples and save it.
+
+        Returns the new dict_id, or None when there was too little text;
+        compression then proceeds without a dictionary.
+        """
+        samples, self.samples = self.samples or [], None
+        trained = save_dictionary(cur, samples)
+        if trained is None:
+            self.compressor = zstandard.ZstdCompressor(level=self.level)
+            return None
+        self.dicts[trained.dict_id()] = trained
+        self.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=trained)
+        return trained.dict_id()
+
+
+def load_dictionaries(cur) -> Dict[int, bytes]:
+    ensure_dict_table(cur)
+    return {dict_id: data for dict_id, data in cur.execute("SELECT dict_id, data FROM text_dicts")}
+
+
+def load_codec(cur, train: bool = False) -> TextCodec:
+    """
+    Codec for the archive behind cur, with every stored dictionary.
+
+    With train=True and no dictionary yet, one is trained straight away
+    if the archive already holds enough text; otherwise the codec trains
+    on the first messages it is asked to compress.
+    """
+    codec = TextCodec(load_dictionaries(cur), train=train)
+    if codec.training:
+        existing = sample_archive(cur)
+        if sum(map(len, existing)) >= TRAIN_BYTES and len(existing) >= TRAIN_MIN_SAMPLES:
+            codec.samples = existing
+            codec.train(cur)
+    return codec
+
+
+def save_dictionary(cur, samples: List[bytes], size: int = DICT_SIZE):
+    """Train a dictionary on samples and store it; None if training isn't possible."""
+    require_zstandard()
+    if len(samples) < 8:
+        return None
+    try:
+        trained = zstandard.train_dictionary(size, samples)
+    except zstandard.ZstdError:
+        # Too little or too uniform text to learn from
+        return None
+    cur.execute("INSERT OR REPLACE INTO text_dicts (dict_id, created_at, samples, data) "
+                "VALUES (?, datetime('now'), ?, ?)",
+                (trained.dict_id(), len(samples), trained.as_bytes()))
+    return trained
+
+
+def sample_archive(cur, codec: Optional[TextCodec] = None, max_samples: int = 20000,
+                   max_bytes: int = TRAIN_BYTES * 4) -> List[bytes]:
+    """Random message bodies from the archive, up to max_bytes of plaintext."""
+    samples = []
+    total = 0
+    for (value,) in cur.execute("""SELECT COALESCE(b.text, m.text) FROM messages m
+            LEFT JOIN bodies b ON b.body_id = m.body_id
+            WHERE m.rowid IN (SELECT rowid FROM messages ORDER BY random() LIMIT ?)""", (max_samples,)):
+        if isinstance(value, bytes):
+            if codec is None:
+                continue
+            value = codec.decompress(value)
+        raw = value.encode("utf-8")
+        if not raw:
+            continue
+        samples.append(raw)
+        total += len(raw)
+        if total >= max_bytes:
+            break
+    return samples
+
+
+def compress_rows_in_place(cur, codec: TextCodec, after_rowid: int = 0, table: str = "messages",
+                           batch: int = 5000) -> Tuple[int, int, int]:
+    """
+    Compress plain-text rows of messages (or bodies) above after_rowid.
+
+    Rowids don't change, so the FTS index (built from plaintext) is left
+    untouched. Returns (rows compressed, bytes before, bytes after).
+    """
+    compressed = before = after = 0
+    last = after_rowid
+    while True:
+        rows = cur.execute(f"""SELECT rowid, text FROM {table}
+            WHERE rowid > ? AND typeof(text) = 'text' ORDER BY rowid LIMIT ?""",
+            (last, batch)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, text in rows:
+            value = codec.compress(text)
+            if isinstance(value, bytes):
+                updates.append((value, rowid))
+                before += len(text.encode("utf-8"))
+                after += len(value)
+        cur.executemany(f"UPDATE {table} SET text = ? WHERE rowid = ?", updates)
+        compressed += len(updates)
+        last = rows[-1][0]
+    return compressed, before, after
+
+
+def plain_text(value: Union[str, bytes, None], codec: Optional[TextCodec]) -> Optional[str]:
+    """Message text as a string, whether it was stored compressed or not."""
+    if isinstance(value, bytes):
+        if codec is None:
+            raise SystemExit("[ERROR] Archive holds compressed text; pass a codec from load_codec()")
+        return codec.decompress(value)
+    return value
+
+
+def reader_codec(con, schema: str = "main") -> Optional[TextCodec]:
+    """
+    Codec for read paths, or None for an archive that was never compressed.
+
+    text_dicts is only created by compressed imports, so plain archives
+    don't need zstandard installed.
+    """
+    if not con.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'text_dicts'").fetchone():
+        return None
+    require_zstandard()
+    return TextCodec({d: data for d, data in con.execute(f"SELECT dict_id, data FROM {schema}.text_dicts")})
+
+
+def register_functions(con, codec: Optional[TextCodec] = None):
+    """Add a plain_text(text) SQL function for ad-hoc queries on compressed archives."""
+    codec = codec or reader_codec(con)
+    con.create_function("plain_text", 1, lambda value: plain_text(value, codec), deterministic=True)
@@ -0,0 +1,200 @@
+# embedding_cache.py
+# Persistent cache of sentence-transformers embeddings, shared by
+# vectorize.py and vectorize_threads.py. Vectors are stored as float32
+# blobs in a SQLite file next to the archive, keyed by model name and a
+# hash of the exact input text, so rebuilding a collection only encodes
+# text the model has never seen. The least recently used vectors are
+# evicted once the file grows past its size limit.
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_MAX_MB = 1024
+# Eviction frees space down to this fraction of the limit, so it runs rarely
+EVICT_TO = 0.9
+# Bound on host parameters per lookup query
+LOOKUP_CHUNK = 500
+
+
+def default_path(db_path: str) -> str:
+    """Cache file next to the archive: archive.sqlite -> archive.embeddings.sqlite."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.embeddings{ext or '.sqlite'}"
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def add_arguments(parser):
+    """Cache flags shared by the vectorizers."""
+    parser.add_argument("--embedding-cache", dest="embedding_cache", metavar="PATH",
+                        help="Embedding cache file (default: <db>.embeddings.sqlite next to the archive)")
+    parser.add_argument("--no-embedding-cache", dest="no_embedding_cache", action="store_true",
+                        help="Encode every text without consulting or filling the cache")
+    parser.add_argument("--cache-max-mb", dest="cache_max_mb", type=float, default=DEFAULT_MAX_MB,
+                        help=f"Evict least recently used vectors beyond this size (default: {DEFAULT_MAX_MB})")
+
+
+def ensure_cache_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS models (
+          model TEXT PRIMARY KEY,
+          dim INTEGER NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+          model TEXT NOT NULL,
+          text_hash BLOB NOT NULL,
+          vector BLOB NOT NULL,
+          last_used INTEGER NOT NULL,
+          PRIMARY KEY (model, text_hash)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+
+
+class CachedEncoder:
+    """
+    Encodes texts through the cache, loading the model only on a miss.
+
+    load() returns the SentenceTransformer; a run whose texts are all
+    cached never calls it. With path=None the cache is disabled and
+    every text goes to the model.
+    """
+
+    def __init__(self, model_name: str, load: Callable, path: Optional[str] = None,
+                 max_mb: float = DEFAULT_MAX_MB, timeout: float = 30.0):
+        self.model_name = model_name
+        self.load = load
+        self._model = None
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.con = None
+        self.size = 0
+        if path:
+            self.con = sqlite3.connect(path, timeout=timeout)
+            self.con.execute("PRAGMA journal_mode=WAL")
+            ensure_cache_schema(self.con.cursor())
+            self.con.commit()
+            self.size = self.con.execute(
+                "SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+            # A lowered --cache-max-mb applies straight away
+            if self.size > self.max_bytes:
+                self._evict()
+                self.con.commit()
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.load()
+            if self.con:
+                self._check_dimension(self._model.get_sentence_embedding_dimension())
+        return self._model
+
+    def dimension(self) -> int:
+        """Embedding size, from the cache when this model has been used before."""
+        if self.con and self._model is None:
+            row = self.con.execute("SELECT dim FROM models WHERE model = ?", (self.model_name,)).fetchone()
+            if row:
+                return row[0]
+        return self.model.get_sentence_embedding_dimension()
+
+    def _check_dimension(self, dim: int):
+        row = self.con.execute("SELECT dim FROM models WHERE model = ?", (self.model_name,)).fetchone()
+        if row and row[0] != dim:
+            # Same name, different model: nothing cached for it is usable
+            self.con.execute("DELETE FROM embeddings WHERE model = ?", (self.model_name,))
+            self.size = self.con.execute(
+                "SELECT COALESCE(SUM(length(vector)), 0) FROM embeddings").fetchone()[0]
+        self.con.execute("INSERT OR REPLACE INTO models (model, dim) VALUES (?, ?)", (self.model_name, dim))
+        self.con.commit()
+
+    def encode(self, texts: List[str], **kwargs):
+        """Embeddings for texts, in order, as a float32 array (one row per text)."""
+        if not self.con:
+            self.misses += len(texts)
+            return self.model.encode(texts, show_progress_bar=False, **kwargs)
+        if not texts:
+            return np.empty((0, self.dimension()), dtype=np.float32)
+
+        keys = [text_key(text) for text in texts]
+        found = self._lookup(set(keys))
+        # Texts repeated within the call are encoded once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += len(missing)
+
+        now = int(time.time())
+        if found:
+            self.con.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                                 [(now, self.model_name, key) for key in found])
+        if missing:
+            encoded = np.asarray(self.model.encode(list(missing.values()), show_progress_bar=False, **kwargs),
+                                 dtype=np.float32)
+            rows = []
+            for key, vector in zip(missing, encoded):
+                found[key] = vector
+                rows.append((self.model_name, key, vector.tobytes(), now))
+            self.con.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) "
+                                 "VALUES (?, ?, ?, ?)", rows)
+            self.size += sum(len(row[2]) for row in rows)
+            if self.size > self.max_bytes:
+                self._evict()
+        self.con.commit()
+        return np.stack([found[key] for key in keys])
+
+    def _lookup(self, keys) -> Dict[bytes, np.ndarray]:
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[start:start + LOOKUP_CHUNK]
+            rows = self.con.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(chunk))})", [self.model_name] + chunk)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _evict(self):
+        """Drop least recently used vectors (of any model) until under EVICT_TO of the limit."""
+        excess = self.size - int(self.max_bytes * EVICT_TO)
+        doomed = []
+        for model, key, size in self.con.execute(
+                "SELECT model, text_hash, length(vector) FROM embeddings ORDER BY last_used"):
+            if excess <= 0:
+                break
+            doomed.append((model, key))
+            excess -= size
+            self.size -= size
+        self.con.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", doomed)
+        self.evicted += len(doomed)
+
+    def summary(self) -> str:
+        if not self.path:
+            return f"Embedding cache disabled; encoded {self.misses} texts"
+        text = (f"Embedding cache: {self.hits} hits, {self.misses} encoded "
+                f"({self.size / 1e6:,.1f} MB in {self.path})")
+        if self.evicted:
+            text += f", evicted {self.evicted}"
+        return text
+
+    def close(self):
+        if self.con:
+            self.con.close()
+            self.con = None
+
+
+def open_encoder(args, db_path: str, load: Callable) -> CachedEncoder:
+    """CachedEncoder configured from add_arguments() flags."""
+    path = None if args.no_embedding_cache else (args.embedding_cache or default_path(db_path))
+    return CachedEncoder(args.model, load, path, args.cache_max_mb)
@@ -3,12 +3,31 @@
 # Supports ChatGPT, Anthropic Claude, and Grok exports
 
 import argparse
+import cProfile
 import os
+import pstats
 import sqlite3
 import hashlib
+import heapq
 import re
 import datetime
-from parsers import chatgpt, anthropic, grok
+import time
+import zipfile
+import multiprocessing
+import random
+import sys
+from queue import Empty, Full
+from collections import deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+import ijson
+from parsers import chatgpt, anthropic, grok, source
+import shards
+import compression
+import vector_mapping
+from ingest_stats import (new_stats, merge_stats, sum_stats, timed, timed_iter,
+                          peak_rss_mb, progress_line, write_report)
 
 PARSERS = {
     "chatgpt": chatgpt,
@@ -35,6 +54,10 @@ def iso_from_epoch(ts):
     except Exception:
         return None
 
+def utc_now_iso() -> str:
+    """Current UTC time in ISO format."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat()
+
 def round_epoch_seconds(ts):
     """Round epoch timestamp to nearest second."""
     if ts is None:
@@ -44,9 +67,116 @@ def round_epoch_seconds(ts):
     except Exception:
         return None
 
-def ensure_schema(db_path: str):
+# Re-imports keep a message's content but take its branch structure and the
+# thread title from the latest export, e.g. after a reply was regenerated
+ON_CONFLICT_REFRESH = """ON CONFLICT(message_id) DO UPDATE SET
+      is_canonical = excluded.is_canonical, parent_message_id = excluded.parent_message_id,
+      title = excluded.title
+    WHERE is_canonical IS NOT excluded.is_canonical
+      OR parent_message_id IS NOT excluded.parent_message_id
+      OR title IS NOT excluded.title"""
+
+INSERT_MSG = f"""INSERT INTO messages
+    (message_id, canonical_thread_id, platform, account_id, ts, role, text, title, source_id,
+     parent_message_id, is_canonical)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    {ON_CONFLICT_REFRESH}"""
+
+# Same row plus body_id; text is left empty when the body lives in bodies
+INSERT_MSG_BODY = f"""INSERT INTO messages
+    (message_id, canonical_thread_id, platform, account_id, ts, role, text, title, source_id,
+     parent_message_id, is_canonical, body_id)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+    {ON_CONFLICT_REFRESH}"""
+
+# Bodies shorter than this stay inline; they gain less than a bodies row costs
+BODY_MIN_BYTES = 256
+
+# Messages above a rowid that still need FTS rows, with their plaintext or
+# stored body. A shared body is only indexed for its first message.
+FTS_PENDING = """SELECT m.rowid AS rowid, m.message_id AS message_id,
+        COALESCE(b.text, m.text) AS body
+    FROM messages m LEFT JOIN bodies b ON b.body_id = m.body_id
+    WHERE m.rowid > ? AND (m.body_id IS NULL OR NOT EXISTS (
+        SELECT 1 FROM messages p WHERE p.body_id = m.body_id AND p.rowid < m.rowid))"""
+
+# Recompute threads rows from messages; callers append a WHERE/GROUP BY
+REFRESH_THREADS = """INSERT OR REPLACE INTO threads
+    (canonical_thread_id, title, platform, account_id, first_ts, last_ts, message_count)
+    SELECT canonical_thread_id, title, platform, account_id, MIN(ts), MAX(ts), COUNT(*)
+    FROM messages"""
+
+# Approximate messages per task handed to a --workers process
+WORKER_CHUNK_MESSAGES = 2000
+
+# Seconds a --jobs worker gets to stop cleanly before it is terminated
+WORKER_STOP_SECONDS = 10
+
+# Messages per write event handed from a parsing stage to the writer
+EVENT_CHUNK_MESSAGES = 1000
+
+# Seconds between intermediate commits of a --bulk transaction, so an
+# interrupted bulk load can be resumed from its last checkpoint
+BULK_CHECKPOINT_SECONDS = 60
+
+# Parser events inspected when sniffing an export's format
+SNIFF_EVENTS = 10000
+
+# Settings applied for the duration of a --bulk load
+BULK_PRAGMAS = {
+    "synchronous": "OFF",
+    "cache_size": -262144,      # 256 MB
+    "temp_store": "MEMORY",
+    "mmap_size": 1073741824,    # 1 GB
+    "locking_mode": "EXCLUSIVE",
+}
+
+# Seconds a connection waits for another process's lock before giving up
+BUSY_TIMEOUT = 30.0
+
+# Extra attempts at opening a write transaction after the busy timeout expires
+BEGIN_RETRIES = 5
+
+CHECKPOINT_MODES = ("auto", "passive", "truncate", "off")
+
+# --checkpoint auto truncates the WAL after imports of at least this many rows
+CHECKPOINT_AUTO_ROWS = 50000
+
+def connect(db_path: str, timeout: float = BUSY_TIMEOUT) -> sqlite3.Connection:
+    """Open a connection that waits up to timeout seconds on other writers."""
+    return sqlite3.connect(db_path, timeout=timeout)
+
+def is_locked(e: sqlite3.OperationalError) -> bool:
+    message = str(e)
+    return "locked" in message or "busy" in message
+
+def begin(con, retries: int = BEGIN_RETRIES):
+    """
+    Open a write transaction with BEGIN IMMEDIATE.
+
+    Taking the write lock up front means a transaction never has to
+    upgrade from a read snapshot, which fails at once (no busy wait) when
+    another process committed in between. If the lock is still held after
+    the busy timeout, retry with jittered exponential backoff.
+    """
+    delay = 0.1
+    for attempt in range(retries + 1):
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not is_locked(e) or attempt == retries:
+                raise
+            time.sleep(delay + random.uniform(0, delay))
+            delay = min(delay * 2, 5.0)
+
+def checkpoint_wal(con, mode: str) -> Tuple[int, int, int]:
+    """Run a WAL checkpoint; returns (busy, WAL pages, pages checkpointed)."""
+    return tuple(con.execute(f"PRAGMA wal_checkpoint({mode.upper()})").fetchone())
+
+def ensure_schema(db_path: str, timeout: float = BUSY_TIMEOUT):
     """Create SQLite schema with FTS support."""
-    con = sqlite3.connect(db_path)
+    con = connect(db_path, timeout)
     cur = con.cursor()
     cur.executescript("""
     PRAGMA journal_mode=WAL;
@@ -67,173 +197,1358 @@ def ensure_schema(db_path: str):
       rowid INTEGER PRIMARY KEY,
       message_id TEXT NOT NULL
     );
+    CREATE TABLE IF NOT EXISTS imports (
+      import_id INTEGER PRIMARY KEY,
+      source_id TEXT NOT NULL,
+      format TEXT NOT NULL,
+      platform TEXT NOT NULL,
+      account_id TEXT NOT NULL,
+      path TEXT NOT NULL,
+      started_at TEXT NOT NULL,
+      finished_at TEXT,
+      threads_seen INTEGER,
+      threads_skipped INTEGER,
+      inserted INTEGER,
+      duplicates INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS conversations (
+      platform TEXT NOT NULL,
+      account_id TEXT NOT NULL,
+      native_thread_id TEXT NOT NULL,
+      canonical_thread_id TEXT,
+      updated_at TEXT,
+      fingerprint TEXT NOT NULL,
+      message_count INTEGER NOT NULL,
+      last_import_id INTEGER,
+      PRIMARY KEY (platform, account_id, native_thread_id)
+    );
     """)
-    con.commit()
+    # Up-to-date archives need no write lock, so readers aren't held up by an import
+    if cur.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        # Concurrent first runs must not both see the old user_version
+        begin(con)
+        migrate_schema(con)
+        con.commit()
     con.close()
 
+def _migrate_fts_rowids(cur):
+    """v1: tie FTS rowids to messages.rowid, re-indexing archives that drifted."""
+    drifted = cur.execute("""
+        SELECT count(*) FROM messages_fts_docids d
+        LEFT JOIN messages m ON m.rowid = d.rowid
+        WHERE m.message_id IS NOT d.message_id
+    """).fetchone()[0]
+    # Rebuilt by migrate_schema once every step has run
+    return bool(drifted)
+
+def _migrate_threads(cur):
+    """v2: secondary indexes and a materialized threads table."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_thread_ts ON messages (canonical_thread_id, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_ts ON messages (ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_source ON messages (source_id)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS threads (
+          canonical_thread_id TEXT PRIMARY KEY,
+          title TEXT,
+          platform TEXT NOT NULL,
+          account_id TEXT NOT NULL,
+          first_ts TEXT NOT NULL,
+          last_ts TEXT NOT NULL,
+          message_count INTEGER NOT NULL
+        )
+    """)
+    cur.execute(REFRESH_THREADS + " GROUP BY canonical_thread_id")
+
+def _migrate_branches(cur):
+    """v3: parent references and a canonical-branch flag on messages."""
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(messages)")}
+    if "parent_message_id" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN parent_message_id TEXT")
+    if "is_canonical" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN is_canonical INTEGER NOT NULL DEFAULT 1")
+
+def _migrate_shards(cur):
+    """v4: catalog of shard files for the sharded layout (empty when unsharded)."""
+    shards.ensure_catalog(cur)
+
+def _migrate_bodies(cur):
+    """v5: content-addressed message bodies referenced by messages.body_id."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bodies (
+          body_id INTEGER PRIMARY KEY,
+          hash TEXT NOT NULL UNIQUE,
+          text NOT NULL
+        )
+    """)
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(messages)")}
+    if "body_id" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN body_id INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_body ON messages (body_id) WHERE body_id IS NOT NULL")
+
+def _migrate_checkpoints(cur):
+    """v6: per-import resume checkpoints (file identity, threads committed, bytes read)."""
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(imports)")}
+    if "file_identity" not in columns:
+        cur.execute("ALTER TABLE imports ADD COLUMN file_identity TEXT")
+    if "threads_done" not in columns:
+        cur.execute("ALTER TABLE imports ADD COLUMN threads_done INTEGER NOT NULL DEFAULT 0")
+    if "byte_offset" not in columns:
+        cur.execute("ALTER TABLE imports ADD COLUMN byte_offset INTEGER NOT NULL DEFAULT 0")
+
+def _migrate_point_ids(cur):
+    """v7: Qdrant mapping tables keyed by deterministic (UUIDv5) point IDs."""
+    vector_mapping.upgrade_mapping_tables(cur)
+
+def _migrate_chunks(cur):
+    """v8: qdrant_chunks mapping for chunked thread embeddings."""
+    vector_mapping.ensure_mapping_tables(cur)
+
+# Ordered schema migrations; an archive at version N runs every step after N
+MIGRATIONS = [
+    _migrate_fts_rowids,
+    _migrate_threads,
+    _migrate_branches,
+    _migrate_shards,
+    _migrate_bodies,
+    _migrate_checkpoints,
+    _migrate_point_ids,
+    _migrate_chunks,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def require_schema(con, db_path: str):
+    """Exit unless the archive is at SCHEMA_VERSION; read-only tools never migrate."""
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        raise SystemExit(f"[ERROR] {db_path} is at schema v{version}, this version needs "
+                         f"v{SCHEMA_VERSION}; run ingest.py or vectorize.py on it once to upgrade it")
+
+def migrate_schema(con):
+    """Upgrade an existing archive in place, tracked with PRAGMA user_version."""
+    cur = con.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    reindex = False
+    for target, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        # A step returns True when the FTS index must be rebuilt against the final schema
+        reindex = step(cur) or reindex
+        cur.execute(f"PRAGMA user_version = {target}")
+    if reindex:
+        rebuild_fts(cur)
+
+def rebuild_fts(cur):
+    """Drop and rebuild the whole FTS index from the messages table."""
+    cur.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+    cur.execute("DELETE FROM messages_fts_docids")
+    return sync_fts(cur)
+
+def sync_fts(cur, codec: Optional[compression.TextCodec] = None,
+             plaintext: Optional[Dict[str, str]] = None) -> int:
+    """
+    Index every message not yet in the FTS index.
+
+    FTS rowids equal messages.rowid, and new messages always get a higher
+    rowid than any indexed one, so the pending rows are exactly those above
+    the last indexed rowid. A body shared through the bodies table is
+    indexed once, under its first message. Compressed bodies are taken from
+    plaintext (message_id -> text) when the caller still has them,
+    otherwise decompressed, so the index always sees plaintext. Returns the
+    number of FTS rows added.
+    """
+    last = cur.execute("SELECT COALESCE(max(rowid), 0) FROM messages_fts_docids").fetchone()[0]
+    cur.execute(f"""INSERT INTO messages_fts (rowid, text)
+        SELECT rowid, body FROM ({FTS_PENDING}) WHERE typeof(body) != 'blob'""", (last,))
+    indexed = cur.rowcount
+    blobs = cur.connection.execute(f"""SELECT rowid, message_id, body FROM ({FTS_PENDING})
+        WHERE typeof(body) = 'blob'""", (last,))
+    first = blobs.fetchone()
+    if first:
+        plaintext = plaintext or {}
+        
+        def text_of(message_id, value):
+            nonlocal codec
+            if message_id in plaintext:
+                return plaintext[message_id]
+            codec = codec or compression.reader_codec(cur.connection)
+            return codec.decompress(value)
+        
+        rows = ((rowid, text_of(message_id, value)) for rowid, message_id, value in chain([first], blobs))
+        cur.executemany("INSERT INTO messages_fts (rowid, text) VALUES (?, ?)", rows)
+        indexed += cur.rowcount
+    cur.execute("""INSERT INTO messages_fts_docids (rowid, message_id)
+        SELECT rowid, message_id FROM messages WHERE rowid > ?""", (last,))
+    return indexed
+
+def iter_threads(messages: Iterator[Dict]) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    Group a parser's message stream into threads without materializing it.
+
+    Parsers emit each conversation's messages contiguously, so a thread is
+    complete as soon as the thread_id changes. Only one thread is held in
+    memory at a time.
+    """
+    current_id = None
+    current = []
+    for msg in messages:
+        tid = msg['thread_id']
+        if current and tid != current_id:
+            yield current_id, current
+            current = []
+        current_id = tid
+        current.append(msg)
+    if current:
+        yield current_id, current
+
+def thread_fingerprint(thread_messages: List[Dict]) -> str:
+    """Cheap fingerprint of a thread's title, native update time and messages as delivered by the parser."""
+    h = hashlib.blake2b(digest_size=16)
+    first = thread_messages[0]
+    h.update(f"{first['thread_title']}\x1f{first.get('thread_updated_at')!r}\x1e".encode("utf-8", errors="ignore"))
+    for msg in thread_messages:
+        h.update(f"{msg['role']}\x1f{msg['created_at']!r}\x1f".encode("utf-8", errors="ignore"))
+        h.update((msg['content'] or "").encode("utf-8", errors="ignore"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+def skip_unchanged(threads: Iterator[Tuple[str, List[Dict]]], cur, platform: str,
+                   account_id: str, counters: Dict,
+                   full: bool = False) -> Iterator[Tuple[Tuple, List[Dict]]]:
+    """
+    Drop threads the conversations manifest says are already imported.
+
+    Runs before any normalization or hashing of message IDs. Yields
+    (manifest_entry, messages) for threads that are new or have changed,
+    where manifest_entry is (native_thread_id, updated_at, fingerprint,
+    message_count), or None for threads without a native ID. updated_at is
+    the platform's own conversation update time when the export has one,
+    so renames and edits change the fingerprint. With full=True nothing is
+    skipped but the manifest is still refreshed.
+    
+    Threads seen before keep their archive thread ID (set as thread_key on
+    the first message), since a rename would otherwise derive a new one.
+    """
+    lookup = """SELECT fingerprint, canonical_thread_id FROM conversations
+        WHERE platform = ? AND account_id = ? AND native_thread_id = ?"""
+    for thread_id, msgs in threads:
+        counters["threads_parsed"] += 1
+        if not thread_id:
+            yield None, msgs
+            continue
+        
+        with timed(counters, "manifest"):
+            fingerprint = thread_fingerprint(msgs)
+            known = cur.execute(lookup, (platform, account_id, thread_id)).fetchone()
+            if full or not (known and known[0] == fingerprint):
+                updated_at = iso_from_epoch(msgs[0].get('thread_updated_at')
+                                            or max(m['created_at'] or 0 for m in msgs))
+                if known and known[1]:
+                    msgs[0]['thread_key'] = known[1]
+        if not full and known and known[0] == fingerprint:
+            counters["threads_skipped"] += 1
+            counters["messages_skipped"] += len(msgs)
+            continue
+        
+        yield (thread_id, updated_at, fingerprint, len(msgs)), msgs
+
+def record_conversation(cur, entry: Tuple, rows: List[Tuple], platform: str,
+                        account_id: str, import_id: int):
+    """Upsert a thread's manifest row after its messages were written."""
+    native_id, updated_at, fingerprint, count = entry
+    thread_key = rows[0][1] if rows else None
+    cur.execute("""INSERT OR REPLACE INTO conversations
+        (platform, account_id, native_thread_id, canonical_thread_id,
+         updated_at, fingerprint, message_count, last_import_id)
+        VALUES (?,?,?,?,?,?,?,?)""",
+        (platform, account_id, native_id, thread_key,
+         updated_at, fingerprint, count, import_id))
+
+def canonical_thread_id(platform: str, account_id: str, first: Dict) -> str:
+    """Generate a stable thread ID from the thread's first message."""
+    first_snip = (first['content'] or "")[:256]
+    return sha1("|".join([
+        platform,
+        account_id,
+        norm_text(first['thread_title']),
+        str(round_epoch_seconds(first['created_at']) or ""),
+        first['role'] or "",
+        norm_text(first_snip)
+    ]))
+
+def thread_rows(thread_messages: List[Dict], platform: str,
+                account_id: str, source_id: str) -> List[Tuple]:
+    """Build the messages rows for one thread, in the parser's order."""
+    # Threads already in the manifest keep their ID. Otherwise generate it from
+    # the parser's anchor (ChatGPT: earliest message in the mapping), so
+    # --branches and edits never change it; or from the earliest message,
+    # found without sorting the thread
+    first = thread_messages[0].get('thread_anchor') or min(thread_messages, key=lambda m: m['created_at'])
+    thread_key = thread_messages[0].get('thread_key') or canonical_thread_id(platform, account_id, first)
+    
+    rows = []
+    ids_by_ref = {}
+    for msg in thread_messages:
+        ts_round = round_epoch_seconds(msg['created_at']) or 0
+        message_id = sha1("|".join([
+            platform, account_id, thread_key, msg['role'] or "",
+            str(ts_round), norm_text(msg['content'] or "")
+        ]))
+        
+        ts_iso = iso_from_epoch(msg['created_at'])
+        if not ts_iso:
+            continue
+        
+        if msg.get('message_ref'):
+            ids_by_ref[msg['message_ref']] = message_id
+        rows.append((
+            message_id, thread_key, platform, account_id,
+            ts_iso, msg['role'] or "", msg['content'] or "",
+            msg['thread_title'], source_id,
+            msg.get('parent_ref'), int(msg.get('is_canonical', True))
+        ))
+    
+    # Resolve platform-native parent references to archive message IDs
+    if ids_by_ref:
+        rows = [row[:9] + (ids_by_ref.get(row[9]),) + row[10:] for row in rows]
+    else:
+        rows = [row[:9] + (None,) + row[10:] for row in rows]
+    return rows
+
+def _rows_for_threads(threads: List[Tuple[object, List[Dict]]], platform: str,
+                      account_id: str, source_id: str) -> Tuple[float, List[Tuple[object, int, List[Tuple]]]]:
+    """Worker task: build rows for a chunk of threads, returning (seconds, items)."""
+    start = time.perf_counter()
+    items = [(key, len(msgs), thread_rows(msgs, platform, account_id, source_id))
+             for key, msgs in threads]
+    return time.perf_counter() - start, items
+
+def iter_thread_rows(threads: Iterator[Tuple[object, List[Dict]]], platform: str,
+                     account_id: str, source_id: str, workers: int = 1,
+                     stats: Optional[Dict] = None) -> Iterator[Tuple[object, int, List[Tuple]]]:
+    """Yield (key, message_count, rows) per thread in input order, building rows in a pool when workers > 1."""
+    if stats is None:
+        stats = new_stats()
+    
+    if workers <= 1:
+        for key, msgs in threads:
+            with timed(stats, "hash"):
+                rows = thread_rows(msgs, platform, account_id, source_id)
+            stats["messages_hashed"] += len(rows)
+            yield key, len(msgs), rows
+        return
+    
+    def collect(future):
+        # hash_seconds is summed across workers
+        seconds, items = future.result()
+        stats["hash_seconds"] += seconds
+        stats["messages_hashed"] += sum(len(rows) for _, _, rows in items)
+        return items
+    
+    # Chunks of ~WORKER_CHUNK_MESSAGES, at most workers * 4 in flight, keep
+    # memory bounded while this process goes on decoding the export
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        chunk = []
+        chunk_size = 0
+        for key, msgs in threads:
+            chunk.append((key, msgs))
+            chunk_size += len(msgs)
+            if chunk_size < WORKER_CHUNK_MESSAGES:
+                continue
+            in_flight.append(pool.submit(_rows_for_threads, chunk, platform, account_id, source_id))
+            chunk = []
+            chunk_size = 0
+            if len(in_flight) >= workers * 4:
+                yield from collect(in_flight.popleft())
+        if chunk:
+            in_flight.append(pool.submit(_rows_for_threads, chunk, platform, account_id, source_id))
+        while in_flight:
+            yield from collect(in_flight.popleft())
+
+def body_hash(raw: bytes) -> str:
+    """Content address of a message body."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def store_bodies(cur, rows: List[Tuple], codec: Optional[compression.TextCodec] = None,
+                 stats: Optional[Dict] = None) -> List[Tuple]:
+    """
+    Move large message bodies into the content-addressed bodies table.
+
+    Returns rows for INSERT_MSG_BODY: bodies of BODY_MIN_BYTES or more are
+    stored once per distinct text (compressed with codec if given) and the
+    row keeps an empty text plus the body_id; other rows get body_id None.
+    Messages already in the archive are passed through untouched, so
+    re-imports never leave unreferenced bodies behind.
+    """
+    text_col = compression.TEXT_COLUMN
+    ids = [row[0] for row in rows]
+    existing = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        existing.update(r[0] for r in cur.execute(
+            f"SELECT message_id FROM messages WHERE message_id IN ({marks})", chunk))
+    
+    row_hashes = []
+    texts = {}
+    for row in rows:
+        raw = row[text_col].encode("utf-8")
+        if row[0] in existing or len(raw) < BODY_MIN_BYTES:
+            row_hashes.append(None)
+            continue
+        digest = body_hash(raw)
+        row_hashes.append(digest)
+        texts.setdefault(digest, row[text_col])
+    if not texts:
+        return [row + (None,) for row in rows]
+    
+    hashes = list(texts)
+    body_ids = {}
+    
+    def lookup():
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            body_ids.update(cur.execute(
+                f"SELECT hash, body_id FROM bodies WHERE hash IN ({marks})", chunk))
+    
+    lookup()
+    new = [(digest, codec.compress(texts[digest]) if codec else texts[digest])
+           for digest in hashes if digest not in body_ids]
+    if new:
+        cur.executemany("INSERT INTO bodies (hash, text) VALUES (?, ?)", new)
+        lookup()
+    if stats is not None:
+        stats["bodies_stored"] += len(new)
+        stats["bodies_shared"] += sum(1 for d in row_hashes if d) - len(new)
+    
+    return [row + (None,) if digest is None
+            else row[:text_col] + ("",) + row[text_col + 1:] + (body_ids[digest],)
+            for row, digest in zip(rows, row_hashes)]
+
+def write_rows(cur, rows: List[Tuple], index_fts: bool = True,
+               stats: Optional[Dict] = None,
+               codec: Optional[compression.TextCodec] = None,
+               dedup: bool = False) -> Tuple[int, int]:
+    """
+    Insert message rows with a single executemany.
+
+    When anything was inserted the touched threads rows are refreshed and,
+    unless index_fts is False, the new rows are added to the FTS index.
+    With a codec, message text is stored compressed; with dedup, large
+    bodies go through store_bodies. The index is always built from the
+    plaintext. Stage timings and counters go to stats if given. Returns
+    (inserted, duplicates).
+    """
+    if not rows:
+        return 0, 0
+    
+    stored = rows
+    if codec:
+        with timed(stats, "compress"):
+            codec.observe(cur, rows)
+    if dedup:
+        with timed(stats, "bodies"):
+            stored = store_bodies(cur, rows, codec, stats)
+    if codec:
+        with timed(stats, "compress"):
+            stored = codec.compress_rows(stored)
+    
+    with timed(stats, "insert"):
+        # Messages of a branch-aware thread that this export leaves out are no
+        # longer on its canonical path; the upsert re-marks the ones it has
+        structured = sorted({row[1] for row in rows if row[9] is not None})
+        cur.executemany("UPDATE messages SET is_canonical = 0 "
+                        "WHERE canonical_thread_id = ? AND is_canonical = 1",
+                        [(key,) for key in structured])
+        # rowcount includes upserted rows; new ones get rowids past the old max
+        last = cur.execute("SELECT COALESCE(max(rowid), 0) FROM messages").fetchone()[0]
+        cur.executemany(INSERT_MSG_BODY if dedup else INSERT_MSG, stored)
+        changed = cur.rowcount
+        ins_count = cur.execute("SELECT count(*) FROM messages WHERE rowid > ?", (last,)).fetchone()[0]
+    
+    if changed > 0:
+        # Upserts alone can retitle a thread
+        with timed(stats, "threads"):
+            refresh_threads(cur, rows)
+    if ins_count:
+        if index_fts:
+            plaintext = None
+            if stored is not rows:
+                plaintext = {row[0]: row[compression.TEXT_COLUMN] for row in rows}
+            with timed(stats, "fts"):
+                indexed = sync_fts(cur, codec, plaintext)
+            if stats is not None:
+                stats["fts_rows"] += indexed
+    if stats is not None:
+        stats["inserted"] += ins_count
+        stats["duplicates"] += len(rows) - ins_count
+    return ins_count, len(rows) - ins_count
+
+def refresh_threads(cur, rows: List[Tuple]):
+    """Bring the threads table up to date for the threads touched by rows."""
+    thread_keys = sorted({row[1] for row in rows})
+    for i in range(0, len(thread_keys), 500):
+        chunk = thread_keys[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        cur.execute(REFRESH_THREADS + f" WHERE canonical_thread_id IN ({marks})"
+                    " GROUP BY canonical_thread_id", chunk)
+
+def apply_bulk_pragmas(con, exclusive: bool = True) -> Dict:
+    """Switch the connection to load-oriented settings, returning the previous ones."""
+    saved = {}
+    for name, value in BULK_PRAGMAS.items():
+        if name == "locking_mode" and not exclusive:
+            continue
+        saved[name] = con.execute(f"PRAGMA {name}").fetchone()[0]
+        con.execute(f"PRAGMA {name} = {value}")
+    return saved
+
+def restore_pragmas(con, saved: Dict):
+    """Restore settings saved by apply_bulk_pragmas."""
+    for name, value in saved.items():
+        con.execute(f"PRAGMA {name} = {value}")
+    # Leaving exclusive locking mode only takes effect on the next access
+    con.execute("SELECT 1 FROM messages LIMIT 1").fetchall()
+
+def detect_format(path: str) -> Optional[str]:
+    """
+    Guess an export's format from its leading bytes and first keys.
+
+    Only the start of the file is read: the scan stops at the first key
+    that identifies a format, or after SNIFF_EVENTS parser events.
+    """
+    with source.open_binary(path) as f:
+        head = f.read(64).lstrip(b"\xef\xbb\xbf \t\r\n")
+    if head[:1] not in (b"[", b"{"):
+        return None
+    
+    with source.open_binary(path) as f:
+        try:
+            for n, (prefix, event, value) in enumerate(ijson.parse(f)):
+                if n > SNIFF_EVENTS:
+                    break
+                if event != "map_key" or prefix not in ("", "item"):
+                    continue
+                if value == "mapping":
+                    return "chatgpt"
+                if value == "chat_messages":
+                    return "anthropic"
+                if value == "conversations" and prefix == "":
+                    return "grok"
+        except ijson.JSONError:
+            return None
+    return None
+
+def collect_inputs(in_path: str) -> List[str]:
+    """
+    Return the parser input paths to ingest.
+
+    A directory is searched recursively for JSON files and ZIP archives;
+    each archive contributes its JSON members as "export.zip!member.json".
+    """
+    if os.path.isdir(in_path):
+        candidates = []
+        for root, dirs, files in os.walk(in_path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith((".json", ".zip")):
+                    candidates.append(os.path.join(root, name))
+    else:
+        candidates = [in_path]
+    
+    found = []
+    for path in candidates:
+        if path.lower().endswith(".zip") and zipfile.is_zipfile(path):
+            found.extend(source.archive_members(path))
+        else:
+            found.append(path)
+    return found
+
+def resolve_format(path: str, forced: Optional[str]) -> Optional[str]:
+    """
+    Pick the parser for one input.
+
+    ZIP archives carry metadata files (users.json, projects.json, ...)
+    next to the conversations, so their members are always sniffed and
+    --format only decides for members that cannot be recognized.
+    """
+    if source.split_archive_path(path)[1] is None:
+        return forced or detect_format(path)
+    detected = detect_format(path)
+    if detected:
+        return detected if not forced or detected == forced else None
+    if forced and os.path.basename(path).lower() == "conversations.json":
+        return forced
+    return None
+
+def fast_forward(threads: Iterator[Tuple[str, List[Dict]]], count: int,
+                 counters: Dict) -> Iterator[Tuple[str, List[Dict]]]:
+    """Drop the first count threads, committed by an interrupted import of the same file."""
+    for thread in threads:
+        if counters["threads_resumed"] < count:
+            counters["threads_resumed"] += 1
+            counters["messages_resumed"] += len(thread[1])
+            continue
+        yield thread
+
+def produce_file(job: Dict, cur, full: bool, workers: int) -> Iterator[Tuple]:
+    """Yield ("threads", ...), ("checkpoint", ...) and a final ("done", ...) write event for one export file."""
+    counters = new_stats()
+    bytes_before = source.bytes_read()
+    parser = PARSERS[job["format"]]
+    if job["format"] == "chatgpt":
+        messages = parser.parse(job["path"], include_branches=job["branches"])
+    else:
+        messages = parser.parse(job["path"])
+    messages = timed_iter(messages, counters, "parse", "messages_parsed")
+    threads = iter_threads(messages)
+    if job.get("resume_threads"):
+        threads = fast_forward(threads, job["resume_threads"], counters)
+    threads = skip_unchanged(threads, cur, job["platform"],
+                             job["account_id"], counters, full=full)
+    
+    # Position of each thread handed to iter_thread_rows, which may run ahead
+    # of its output; unchanged threads before it count as done too
+    marks = deque()
+    
+    def marked(threads):
+        for thread in threads:
+            marks.append((counters["threads_resumed"] + counters["threads_parsed"],
+                          source.bytes_read() - bytes_before))
+            yield thread
+    
+    chunk = []
+    chunk_size = 0
+    mark = None
+    for item in iter_thread_rows(marked(threads), job["platform"], job["account_id"],
+                                 job["source_id"], workers, counters):
+        chunk.append(item)
+        chunk_size += item[1]
+        mark = marks.popleft()
+        if chunk_size >= EVENT_CHUNK_MESSAGES:
+            yield ("threads", job["index"], chunk)
+            # Once committed, a resumed import may skip the first threads_done threads
+            yield ("checkpoint", job["index"], mark)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        yield ("threads", job["index"], chunk)
+    counters["bytes_read"] = source.bytes_read() - bytes_before
+    yield ("done", job["index"], counters)
+
+def iter_serial(jobs: List[Dict], cur, full: bool, workers: int) -> Iterator[Tuple]:
+    """Produce write events for each file in turn in this process."""
+    for job in jobs:
+        try:
+            yield from produce_file(job, cur, full, workers)
+        except SystemExit as e:
+            yield ("error", job["index"], str(e))
+
+def _put_unless_stopped(queue, event, stop) -> bool:
+    """Put event on the queue, giving up once stop is set; False if it was dropped."""
+    while not stop.is_set():
+        try:
+            queue.put(event, timeout=0.5)
+            return True
+        except Full:
+            pass
+    return False
+
+def _file_worker(job: Dict, db_path: str, full: bool, workers: int, queue, stop):
+    """Process target: parse one file and push its write events to the queue until stop is set."""
+    con = None
+    events = None
+    try:
+        # Read-only use: manifest lookups run against a snapshot of the archive
+        con = connect(db_path)
+        events = produce_file(job, con.cursor(), full, workers)
+        for event in events:
+            if not _put_unless_stopped(queue, event, stop):
+                break
+    except (SystemExit, Exception) as e:
+        _put_unless_stopped(queue, ("error", job["index"], str(e)), stop)
+    finally:
+        # Shuts down a --workers pool; nobody reads what is still buffered
+        if events is not None:
+            events.close()
+        if stop.is_set():
+            queue.cancel_join_thread()
+        if con is not None:
+            con.close()
+
+def iter_parallel(jobs: List[Dict], db_path: str, full: bool, workers: int,
+                  max_jobs: int) -> Iterator[Tuple]:
+    """
+    Parse up to max_jobs files concurrently, yielding their write events.
+
+    Each file is parsed in its own process and its events are funnelled
+    through one bounded queue, so this process stays the only writer.
+    """
+    ctx = multiprocessing.get_context()
+    queue = ctx.Queue(maxsize=max_jobs * 8)
+    stop = ctx.Event()
+    waiting = list(jobs)
+    running = {}
+    
+    def start_next():
+        job = waiting.pop(0)
+        proc = ctx.Process(target=_file_worker, args=(job, db_path, full, workers, queue, stop))
+        proc.start()
+        running[job["index"]] = proc
+    
+    try:
+        while waiting and len(running) < max_jobs:
+            start_next()
+        
+        while running:
+            try:
+                event = queue.get(timeout=1.0)
+            except Empty:
+                # A worker that died without reporting (e.g. killed) would block us forever
+                for index, proc in list(running.items()):
+                    if not proc.is_alive() and proc.exitcode:
+                        running.pop(index)
+                        yield ("error", index, f"worker exited with code {proc.exitcode}")
+                        if waiting:
+                            start_next()
+                continue
+        
+            yield event
+            if event[0] in ("done", "error") and event[1] in running:
+                running.pop(event[1]).join()
+                if waiting:
+                    start_next()
+    finally:
+        # Workers are non-daemonic and would block on the full queue forever
+        # once nothing reads it, e.g. after the writer failed
+        stop.set()
+        for proc in running.values():
+            proc.join(WORKER_STOP_SECONDS)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join()
+        queue.close()
+        queue.cancel_join_thread()
+
+def begin_import(cur, job: Dict) -> int:
+    """Record the start of a file's import and return its import_id."""
+    cur.execute("""INSERT INTO imports
+        (source_id, format, platform, account_id, path, started_at,
+         file_identity, threads_done, byte_offset)
+        VALUES (?,?,?,?,?,?,?,?,?)""",
+        (job["source_id"], job["format"], job["platform"], job["account_id"],
+         os.path.abspath(job["path"]), utc_now_iso(), job["identity"],
+         job.get("resume_threads", 0), job.get("resume_bytes", 0)))
+    return cur.lastrowid
+
+def find_checkpoint(cur, job: Dict) -> Optional[Tuple[int, int, int]]:
+    """
+    (import_id, threads_done, byte_offset) of an interrupted import to resume.
+
+    Only the latest import of the same file, format, platform and account
+    counts, and only if it never finished and the file is unchanged since.
+    """
+    row = cur.execute("""SELECT import_id, file_identity, finished_at, threads_done, byte_offset
+        FROM imports WHERE path = ? AND format = ? AND platform = ? AND account_id = ?
+        ORDER BY import_id DESC LIMIT 1""",
+        (os.path.abspath(job["path"]), job["format"], job["platform"], job["account_id"])).fetchone()
+    if not row or row[2] or not row[3] or not job["identity"] or row[1] != job["identity"]:
+        return None
+    return row[0], row[3], row[4]
+
+def save_checkpoint(cur, job: Dict, threads_done: int, byte_offset: int):
+    """Record how far a file's import has committed."""
+    cur.execute("UPDATE imports SET threads_done = ?, byte_offset = ? WHERE import_id = ?",
+                (threads_done, byte_offset, job["import_id"]))
+
+def finish_import(cur, job: Dict, stats: Dict):
+    """Record a file's final counters in the imports table."""
+    cur.execute("""UPDATE imports SET finished_at = ?, threads_seen = ?,
+        threads_skipped = ?, inserted = ?, duplicates = ?, threads_done = ?, byte_offset = ?
+        WHERE import_id = ?""",
+        (utc_now_iso(), stats["threads"] + stats["threads_skipped"] + stats["threads_resumed"],
+         stats["threads_skipped"], stats["inserted"], stats["duplicates"],
+         stats["threads"] + stats["threads_skipped"] + stats["threads_resumed"],
+         stats["bytes_read"], job["import_id"]))
+
+def new_file_stats() -> Dict:
+    """
+    Per-file stats kept by the writer.
+
+    messages/threads count what reached the writer; the parse, manifest and
+    hash stages are merged in from the producer's "done" event.
+    """
+    stats = new_stats()
+    stats.update({"messages": 0, "threads": 0, "error": None})
+    return stats
+
+def write_events(con, events: Iterator[Tuple], jobs: List[Dict], stats: List[Dict],
+                 bulk: bool, batch_size: int, index_fts: bool,
+                 progress: float = 0, started: Optional[float] = None,
+                 router: Optional[shards.ShardRouter] = None,
+                 codecs: Optional[Dict] = None, dedup: bool = False):
+    """
+    Apply write events from iter_serial/iter_parallel through one connection.
+
+    A router sends message rows to shard connections; codecs, filled in here, compress text.
+    """
+    cur = con.cursor()
+    pending = {}  # (file index, target connection) -> buffered rows
+    marks = {}  # file index -> checkpoint awaiting the next bulk commit
+    since_report = 0
+    started = started or time.perf_counter()
+    bytes_start = source.bytes_read()
+    next_progress = started + progress
+    next_checkpoint = time.perf_counter() + BULK_CHECKPOINT_SECONDS
+    
+    # One (codec, {table: rowid before this run}) entry per target connection
+    def codec_for(target):
+        if codecs is None:
+            return None
+        if target not in codecs:
+            # Outside bulk mode each thread opens its own transaction
+            if not bulk:
+                begin(target)
+            start = {table: target.execute(f"SELECT COALESCE(max(rowid), 0) FROM {table}").fetchone()[0]
+                     for table in ("messages", "bodies")}
+            codecs[target] = (compression.load_codec(target.cursor(), train=True), start)
+            if not bulk:
+                target.commit()
+        return codecs[target][0]
+    
+    def flush(index, target=None):
+        inserted = 0
+        for key in [k for k in pending if k[0] == index and target in (None, k[1])]:
+            rows = pending.pop(key)
+            ins, _ = write_rows(key[1].cursor(), rows, index_fts, stats[index],
+                                codec_for(key[1]), dedup)
+            inserted += ins
+        return inserted
+    
+    def lock(file_stats, target=None):
+        with timed(file_stats, "lock"):
+            begin(target or con)
+    
+    def commit(file_stats, target=None):
+        with timed(file_stats, "commit"):
+            (target or con).commit()
+        file_stats["commits"] += 1
+    
+    def bulk_checkpoint(file_stats):
+        # Write every file's buffered rows so the checkpoints only cover committed threads
+        inserted = 0
+        for i in {key[0] for key in pending}:
+            inserted += flush(i)
+        for i, mark in marks.items():
+            save_checkpoint(cur, jobs[i], *mark)
+        marks.clear()
+        for target in (router.connections.values() if router else []):
+            commit(file_stats, target)
+            begin(target)
+        commit(file_stats)
+        begin(con)
+        return inserted
+    
+    for kind, index, payload in events:
+        job = jobs[index]
+        file_stats = stats[index]
+        
+        if kind == "threads":
+            for entry, thread_size, rows in payload:
+                file_stats["messages"] += thread_size
+                file_stats["threads"] += 1
+                
+                target = router.connection(job["platform"], rows) if router else con
+                codec = codec_for(target)
+                if bulk:
+                    # Buffer across threads into batch_size executemany calls; the
+                    # caller holds one long transaction
+                    buffered = pending.setdefault((index, target), [])
+                    buffered.extend(rows)
+                    if entry:
+                        record_conversation(cur, entry, rows, job["platform"],
+                                            job["account_id"], job["import_id"])
+                    if len(buffered) >= batch_size:
+                        since_report += flush(index, target)
+                else:
+                    # One BEGIN IMMEDIATE per thread, so other processes can write in
+                    # between. Catalog before shard, the same order in every process
+                    lock(file_stats)
+                    if target is not con:
+                        lock(file_stats, target)
+                    inserted, _ = write_rows(target.cursor(), rows, index_fts, file_stats, codec, dedup)
+                    if entry:
+                        record_conversation(cur, entry, rows, job["platform"],
+                                            job["account_id"], job["import_id"])
+                    # Shard before manifest: an interrupted run only re-dedupes the thread
+                    if target is not con:
+                        commit(file_stats, target)
+                    commit(file_stats)
+                    since_report += inserted
+            
+            if since_report >= 2000:
+                ins_count = sum(s["inserted"] for s in stats)
+                dup_count = sum(s["duplicates"] for s in stats)
+                label = "Wrote" if bulk else "Committed"
+                print(f"  [*] {label} batch ({ins_count} inserted, {dup_count} duplicates)")
+                since_report = 0
+            
+            now = time.perf_counter()
+            if progress and now >= next_progress:
+                print(progress_line(now - started, sum(s["messages"] for s in stats),
+                                    sum(s["inserted"] for s in stats),
+                                    source.bytes_read() - bytes_start))
+                next_progress = now + progress
+            continue
+        
+        # Recorded at once outside bulk mode, in bulk mode with the next
+        # intermediate commit (every BULK_CHECKPOINT_SECONDS)
+        if kind == "checkpoint":
+            if not bulk:
+                lock(file_stats)
+                save_checkpoint(cur, job, *payload)
+                commit(file_stats)
+            else:
+                marks[index] = payload
+                if time.perf_counter() >= next_checkpoint:
+                    since_report += bulk_checkpoint(file_stats)
+                    next_checkpoint = time.perf_counter() + BULK_CHECKPOINT_SECONDS
+            continue
+        
+        flush(index)
+        if kind == "error":
+            file_stats["error"] = payload
+            print(f"  [!] {job['path']}: {payload}")
+            continue
+        
+        marks.pop(index, None)
+        merge_stats(file_stats, payload)
+        if not bulk:
+            lock(file_stats)
+        finish_import(cur, job, file_stats)
+        if not bulk:
+            commit(file_stats)
+        if len(jobs) > 1:
+            print(f"  [+] {job['path']} ({job['format']}): "
+                  f"{file_stats['messages']} messages in {file_stats['threads']} threads, "
+                  f"{file_stats['inserted']} inserted, {file_stats['duplicates']} duplicates, "
+                  f"{file_stats['threads_skipped']} unchanged threads skipped")
+
+PREVIEW_SAMPLES = 5
+PREVIEW_TOP_THREADS = 5
+
+def preview_export(parser, in_path: str, limit: Optional[int] = None):
+    """
+    Test mode: print sample messages and thread statistics for one export.
+
+    Runs in a single pass over the parser generator, keeping only the first
+    few messages, a per-thread message count and a small heap of the
+    largest threads. With limit, parsing stops after that many messages.
+    """
+    messages = parser.parse(in_path)
+    samples = []
+    counts = {}
+    first_seen = {}
+    top = []  # min-heap of (count, -first_seen, thread_id, title)
+    total = 0
+    
+    def push_top(tid, title):
+        entry = (counts[tid], -first_seen[tid], tid, title)
+        for i, item in enumerate(top):
+            if item[2] == tid:
+                top[i] = entry
+                heapq.heapify(top)
+                return
+        if len(top) < PREVIEW_TOP_THREADS:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+    
+    try:
+        for tid, msgs in iter_threads(messages):
+            if tid not in counts:
+                counts[tid] = 0
+                first_seen[tid] = len(first_seen)
+            for msg in msgs:
+                if limit is not None and total >= limit:
+                    break
+                if len(samples) < PREVIEW_SAMPLES:
+                    samples.append(msg)
+                counts[tid] += 1
+                total += 1
+            push_top(tid, msgs[0]['thread_title'])
+            if limit is not None and total >= limit:
+                break
+    finally:
+        messages.close()
+    
+    if not total:
+        print("[!] No messages found in export")
+        return
+    
+    print(f"[+] Parsed {total} messages from {len(counts)} threads\n")
+    if limit is not None and total >= limit:
+        print(f"[*] Stopped after --sample {limit} messages; statistics cover only that prefix\n")
+    
+    print("[TEST MODE] Sample messages:\n")
+    
+    # Show first 5 messages
+    for i, msg in enumerate(samples, 1):
+        print(f"Message {i}:")
+        print(f"  Thread: {msg['thread_title'][:50] or '(no title)'}")
+        print(f"  Role: {msg['role']}")
+        print(f"  Content: {msg['content'][:100]}...")
+        print(f"  Created: {iso_from_epoch(msg['created_at'])}")
+        print()
+    
+    if total > len(samples):
+        print(f"... and {total - len(samples)} more messages")
+    
+    # Show thread statistics
+    print(f"\n[STATS] Thread Statistics:")
+    print(f"  Total threads: {len(counts)}")
+    print(f"  Average messages per thread: {total / len(counts):.1f}")
+    print(f"\n  Top {PREVIEW_TOP_THREADS} threads by message count:")
+    for i, (count, _, _, title) in enumerate(sorted(top, reverse=True), 1):
+        print(f"    {i}. {title[:60] or '(no title)'}: {count} messages")
+
 def main():
     ap = argparse.ArgumentParser(
         description="Ingest LLM conversation exports into SQLite",
         epilog="Supported formats: chatgpt, anthropic, grok"
     )
     ap.add_argument("--in", dest="in_path", required=True,
-                    help="Path to export file (JSON)")
+                    help="Path to export file (JSON or ZIP) or a directory of exports")
     ap.add_argument("--db", dest="db_path",
                     help="Path to SQLite database (required unless --test)")
-    ap.add_argument("--format", dest="format", required=True,
+    ap.add_argument("--format", dest="format", default=None,
                     choices=list(PARSERS.keys()),
-                    help="Export format: chatgpt, anthropic, or grok")
+                    help="Export format: chatgpt, anthropic, or grok (auto-detected if omitted)")
     ap.add_argument("--platform", default=None,
                     help="Platform name (defaults to format)")
     ap.add_argument("--account", dest="account_id", default="main",
                     help="Account identifier")
     ap.add_argument("--source-id", dest="source_id", default="src_0001",
                     help="Unique ID for this import batch")
+    ap.add_argument("--defer-fts", action="store_true",
+                    help="Build the full-text index once at the end (faster for large imports)")
+    ap.add_argument("--bulk", action="store_true",
+                    help="Bulk-load mode: one long transaction, large batches, relaxed durability")
+    ap.add_argument("--batch-size", type=int, default=50000,
+                    help="Rows per executemany batch in --bulk mode")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processes for normalizing and hashing messages (default: 1)")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Export files parsed concurrently when --in is a directory (default: 1)")
+    ap.add_argument("--branches", action="store_true",
+                    help="Also store alternate ChatGPT branches (edits/regenerations)")
+    ap.add_argument("--shard-by", dest="shard_by", default=None, choices=shards.SHARD_BY,
+                    help="Store messages in per-platform or per-year shard databases next to --db")
+    ap.add_argument("--compress", action="store_true",
+                    help="Store message text zstd-compressed with a dictionary trained on the archive "
+                         "(needs the zstandard package)")
+    ap.add_argument("--dedup-bodies", dest="dedup_bodies", action="store_true",
+                    help="Store each distinct large message body once and index it once")
+    ap.add_argument("--concurrent", action="store_true",
+                    help="Share the database with other ingest runs and readers (no exclusive locking)")
+    ap.add_argument("--busy-timeout", dest="busy_timeout", type=float, default=BUSY_TIMEOUT,
+                    metavar="SECONDS",
+                    help=f"Wait this long for other writers' locks before retrying (default: {BUSY_TIMEOUT:g})")
+    ap.add_argument("--checkpoint", choices=CHECKPOINT_MODES, default="auto",
+                    help="WAL checkpoint after the import; auto truncates the WAL after --bulk "
+                         f"or {CHECKPOINT_AUTO_ROWS}+ inserted rows")
+    ap.add_argument("--full", action="store_true",
+                    help="Reprocess every conversation, ignoring the import manifest")
+    ap.add_argument("--resume", action="store_true",
+                    help="Continue interrupted imports of the same files from their last checkpoint")
     ap.add_argument("--test", action="store_true",
                     help="Test mode: show parsed messages without writing to DB")
+    ap.add_argument("--sample", type=int, default=None, metavar="N",
+                    help="Test mode: stop after N messages instead of parsing the whole export")
+    ap.add_argument("--stats-json", dest="stats_json", default=None,
+                    help="Write per-stage timings and counters as JSON to this path "
+                         "('-' for stdout, moving the log to stderr)")
+    ap.add_argument("--progress", type=float, default=0, metavar="SECONDS",
+                    help="Print a progress line with rates every SECONDS (default: off)")
+    ap.add_argument("--profile", default=None, metavar="PATH",
+                    help="Run the write loop under cProfile and save stats to PATH")
     args = ap.parse_args()
 
+    # With --stats-json - stdout carries only the JSON report; the log goes to stderr
+    report_stream = sys.stdout
+    if args.stats_json == "-":
+        sys.stdout = sys.stderr
+
     # Test mode doesn't require --db
     if not args.test and not args.db_path:
         ap.error("--db is required unless using --test mode")
+    if args.compress and not args.test:
+        compression.require_zstandard()
+    if args.sample is not None and (not args.test or args.sample < 1):
+        ap.error("--sample N requires --test and N >= 1")
 
-    platform = args.platform or args.format
-
-    # Load parser
-    parser = PARSERS[args.format]
-    
-    print(f"\n[*] Parsing {args.format} export: {args.in_path}\n")
-    
-    # Parse messages
-    messages = list(parser.parse(args.in_path))
-    
-    if not messages:
-        print("[!] No messages found in export")
+    # Resolve each input file's format
+    paths = collect_inputs(args.in_path)
+    if not paths:
+        print(f"[!] No export files found in {args.in_path}")
         return
     
-    print(f"[+] Parsed {len(messages)} messages from {len(set(m['thread_id'] for m in messages))} threads\n")
+    jobs = []
+    for path in paths:
+        fmt = resolve_format(path, args.format)
+        if not fmt:
+            if len(paths) == 1:
+                raise SystemExit(f"[ERROR] Could not detect export format of {path}; use --format")
+            print(f"[!] Skipping {path}: unrecognized export format")
+            continue
+        jobs.append({
+            "index": len(jobs),
+            "path": path,
+            "format": fmt,
+            "platform": args.platform or fmt,
+            "account_id": args.account_id,
+            "source_id": args.source_id,
+            "branches": args.branches,
+        })
     
     # Test mode: just show sample and exit
     if args.test:
-        print("[TEST MODE] Sample messages:\n")
-        
-        # Show first 5 messages
-        for i, msg in enumerate(messages[:5], 1):
-            print(f"Message {i}:")
-            print(f"  Thread: {msg['thread_title'][:50] or '(no title)'}")
-            print(f"  Role: {msg['role']}")
-            print(f"  Content: {msg['content'][:100]}...")
-            print(f"  Created: {iso_from_epoch(msg['created_at'])}")
-            print()
-        
-        if len(messages) > 5:
-            print(f"... and {len(messages) - 5} more messages")
-        
-        # Show thread statistics
-        threads = {}
-        for msg in messages:
-            tid = msg['thread_id']
-            if tid not in threads:
-                threads[tid] = {"title": msg['thread_title'], "count": 0}
-            threads[tid]["count"] += 1
-        
-        print(f"\n[STATS] Thread Statistics:")
-        print(f"  Total threads: {len(threads)}")
-        print(f"  Average messages per thread: {len(messages) / len(threads):.1f}")
-        print(f"\n  Top 5 threads by message count:")
-        for i, (tid, data) in enumerate(sorted(threads.items(), key=lambda x: x[1]["count"], reverse=True)[:5], 1):
-            print(f"    {i}. {data['title'][:60] or '(no title)'}: {data['count']} messages")
-        
+        for job in jobs:
+            print(f"\n[*] Parsing {job['format']} export: {job['path']}\n")
+            try:
+                preview_export(PARSERS[job["format"]], job["path"], args.sample)
+            except SystemExit as e:
+                if len(jobs) == 1:
+                    raise
+                print(f"  [!] {e}")
         print("\n[+] Test complete - no database was modified")
         return
     
+    for job in jobs:
+        print(f"\n[*] Parsing {job['format']} export: {job['path']}")
+    print()
+    
     # Production mode: write to database
     db_dir = os.path.dirname(args.db_path)
     if db_dir:
         os.makedirs(db_dir, exist_ok=True)
-    ensure_schema(args.db_path)
+    ensure_schema(args.db_path, args.busy_timeout)
     
-    con = sqlite3.connect(args.db_path)
+    con = connect(args.db_path, args.busy_timeout)
     cur = con.cursor()
-    insert_msg = """INSERT OR IGNORE INTO messages
-        (message_id, canonical_thread_id, platform, account_id, ts, role, text, title, source_id)
-        VALUES (?,?,?,?,?,?,?,?,?)"""
     
-    ins_count = 0
-    dup_count = 0
-    batch = 0
+    # A catalog keeps the layout it was created with
+    shard_by, _ = shards.load_layout(con)
+    if args.shard_by and shard_by and args.shard_by != shard_by:
+        raise SystemExit(f"[ERROR] {args.db_path} is sharded by {shard_by}, not {args.shard_by}")
+    if args.shard_by and not shard_by and cur.execute("SELECT 1 FROM messages LIMIT 1").fetchone():
+        raise SystemExit(f"[ERROR] {args.db_path} already holds unsharded messages; "
+                         f"use a new --db path for a sharded archive")
+    shard_by = args.shard_by or shard_by
     
-    # Group messages by thread
-    threads = {}
-    for msg in messages:
-        tid = msg['thread_id']
-        if tid not in threads:
-            threads[tid] = []
-        threads[tid].append(msg)
+    begin(con)
+    for job in jobs:
+        job["identity"] = source.identity(job["path"])
+        checkpoint = find_checkpoint(cur, job) if args.resume else None
+        if checkpoint:
+            _, job["resume_threads"], job["resume_bytes"] = checkpoint
+            print(f"[*] Resuming {job['path']} after {job['resume_threads']} threads "
+                  f"(~{job['resume_bytes'] / 1e6:,.1f} MB) committed by import {checkpoint[0]}")
+        job["import_id"] = begin_import(cur, job)
+    con.commit()
+    stats = [new_file_stats() for _ in jobs]
+    parallel = args.jobs > 1 and len(jobs) > 1
     
     print(f"[*] Writing to database: {args.db_path}\n")
     
-    for thread_id, thread_messages in threads.items():
-        # Sort by timestamp
-        thread_messages.sort(key=lambda m: m['created_at'])
-        
-        first = thread_messages[0]
-        first_snip = (first['content'] or "")[:256]
-        
-        # Generate canonical thread ID
-        canonical_thread_id = sha1("|".join([
-            platform,
-            args.account_id,
-            norm_text(first['thread_title']),
-            str(round_epoch_seconds(first['created_at']) or ""),
-            first['role'] or "",
-            norm_text(first_snip)
-        ]))
+    # Exclusive locking would shut out the parsing processes' manifest lookups,
+    # and with --concurrent other ingest runs and readers too
+    exclusive = not parallel and not args.concurrent
+    saved_pragmas = apply_bulk_pragmas(con, exclusive=exclusive) if args.bulk else None
+    shard_pragmas = {}
+    
+    def open_shard(shard_con):
+        # Without --concurrent shards are only touched by this process
+        if args.bulk:
+            shard_pragmas[shard_con] = apply_bulk_pragmas(shard_con, exclusive=not args.concurrent)
+            begin(shard_con)
+    
+    router = None
+    if shard_by:
+        router = shards.ShardRouter(args.db_path, con, shard_by,
+                                    lambda path: ensure_schema(path, args.busy_timeout),
+                                    open_shard, args.busy_timeout)
+        print(f"[*] Sharding messages by {shard_by}\n")
+    codecs = {} if args.compress else None
+    profiler = cProfile.Profile() if args.profile else None
+    # Work that isn't tied to one file (deferred FTS, final commit)
+    run_stats = new_stats()
+    start = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        if args.bulk:
+            begin(con)
         
-        cur.execute("BEGIN")
-        for msg in thread_messages:
-            ts_round = round_epoch_seconds(msg['created_at']) or 0
-            message_id = sha1("|".join([
-                platform, args.account_id, canonical_thread_id, msg['role'] or "",
-                str(ts_round), norm_text(msg['content'] or "")
-            ]))
-            
-            ts_iso = iso_from_epoch(msg['created_at'])
-            if not ts_iso:
-                continue
-            
-            cur.execute(insert_msg, (
-                message_id, canonical_thread_id, platform, args.account_id,
-                ts_iso, msg['role'] or "", msg['content'] or "",
-                msg['thread_title'], args.source_id
-            ))
-            
-            if cur.rowcount == 0:
-                dup_count += 1
-                continue
-            
-            # FTS insert
-            cur.execute("INSERT INTO messages_fts (text) VALUES (?)", (msg['content'] or "",))
-            fts_rowid = cur.execute("SELECT max(rowid) FROM messages_fts").fetchone()[0]
-            cur.execute("INSERT INTO messages_fts_docids (rowid, message_id) VALUES (?,?)",
-                       (fts_rowid, message_id))
-            
-            ins_count += 1
-            batch += 1
-            if batch >= 2000:
-                con.commit()
-                print(f"  [*] Committed batch ({ins_count} inserted, {dup_count} duplicates)")
-                batch = 0
-        con.commit()
+        # Stream conversations straight from the parsers: each thread is written
+        # as soon as it is complete, so memory is bounded by the largest thread
+        if parallel:
+            events = iter_parallel(jobs, args.db_path, args.full, args.workers, args.jobs)
+        else:
+            events = iter_serial(jobs, cur, args.full, args.workers)
+        try:
+            write_events(con, events, jobs, stats, args.bulk, args.batch_size, not args.defer_fts,
+                         args.progress, start, router, codecs, args.dedup_bodies)
+        finally:
+            # Stops the --jobs workers now rather than when the generator is collected
+            events.close()
+        
+        # Connections holding messages: the shards written this run, or the archive itself
+        targets = list(router.connections.values()) if router else [con]
+        if args.defer_fts:
+            print(f"[*] Building full-text index...")
+            indexed = 0
+            for target in targets:
+                if not args.bulk:
+                    begin(target)
+                with timed(run_stats, "fts"):
+                    indexed += sync_fts(target.cursor())
+            run_stats["fts_rows"] += indexed
+            print(f"  [+] Indexed {indexed} messages")
+        
+        # Rows written before a dictionary could be trained are still plain
+        for target, (codec, first_rowids) in (codecs or {}).items():
+            if not args.bulk and not target.in_transaction:
+                begin(target)
+            with timed(run_stats, "compress"):
+                if codec.training:
+                    codec.train(target.cursor())
+                for table, first_rowid in first_rowids.items():
+                    compression.compress_rows_in_place(target.cursor(), codec, first_rowid, table)
+        
+        with timed(run_stats, "commit"):
+            for target in targets:
+                if target is not con:
+                    target.commit()
+            con.commit()
+        run_stats["commits"] += 1
+        
+        checkpoint = args.checkpoint
+        if checkpoint == "auto":
+            inserted = sum(s["inserted"] for s in stats)
+            checkpoint = "truncate" if args.bulk or inserted >= CHECKPOINT_AUTO_ROWS else "off"
+        if checkpoint != "off":
+            # Fold the WAL back into the database so readers don't scan a huge log
+            busy = 0
+            with timed(run_stats, "checkpoint"):
+                for target in dict.fromkeys(targets + [con]):
+                    busy += checkpoint_wal(target, checkpoint)[0]
+            if busy:
+                print(f"[!] WAL checkpoint ({checkpoint}) incomplete: other connections still reading")
+            else:
+                print(f"[*] WAL checkpoint ({checkpoint}) complete")
+    finally:
+        if profiler:
+            profiler.disable()
+        # After a failure the bulk transaction is still open, and PRAGMA synchronous
+        # can't change inside one; rows since the last checkpoint are dropped
+        for target in [con] + (list(router.connections.values()) if router else []):
+            if target.in_transaction:
+                target.rollback()
+        for shard_con, saved in shard_pragmas.items():
+            restore_pragmas(shard_con, saved)
+        if saved_pragmas:
+            restore_pragmas(con, saved_pragmas)
+        if router:
+            router.close()
+    elapsed = time.perf_counter() - start
+    
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print(f"[*] Profile saved to {args.profile}; top functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    
+    msg_count = sum(s["messages"] for s in stats)
+    thread_count = sum(s["threads"] for s in stats)
+    ins_count = sum(s["inserted"] for s in stats)
+    dup_count = sum(s["duplicates"] for s in stats)
+    skipped = sum(s["threads_skipped"] for s in stats)
+    skipped_messages = sum(s["messages_skipped"] for s in stats)
+    resumed = sum(s["threads_resumed"] for s in stats)
+    failed = [job["path"] for job, s in zip(jobs, stats) if s["error"]]
+    
+    if codecs:
+        raw = sum(codec.raw_bytes for codec, _ in codecs.values())
+        stored = sum(codec.stored_bytes for codec, _ in codecs.values())
+        run_stats["text_bytes"] = raw
+        run_stats["stored_text_bytes"] = stored
+        if raw:
+            print(f"[+] Compressed text: {raw / 1e6:,.1f} MB -> {stored / 1e6:,.1f} MB "
+                  f"({raw / stored if stored else 0:.1f}x)")
+    
+    if args.stats_json:
+        totals = sum_stats(stats + [run_stats])
+        report = {
+            "meta": {
+                "db": args.db_path,
+                "bulk": args.bulk,
+                "defer_fts": args.defer_fts,
+                "workers": args.workers,
+                "jobs": args.jobs,
+                "shard_by": shard_by,
+                "compress": args.compress,
+                "dedup_bodies": args.dedup_bodies,
+                "concurrent": args.concurrent,
+                "resume": args.resume,
+                "busy_timeout": args.busy_timeout,
+                "checkpoint": args.checkpoint,
+                "timestamp": utc_now_iso(),
+            },
+            "elapsed_seconds": round(elapsed, 4),
+            "messages_per_second": round(msg_count / elapsed, 1) if elapsed else None,
+            # Children are only reaped (and counted) once their pools shut down
+            "peak_rss_mb": peak_rss_mb(),
+            "totals": totals,
+            "files": [dict(s, path=job["path"], format=job["format"])
+                      for job, s in zip(jobs, stats)],
+        }
+        write_report(args.stats_json, report, report_stream)
+        if args.stats_json != "-":
+            print(f"[*] Stats written to {args.stats_json}")
     
-    total = cur.execute("SELECT count(*) FROM messages").fetchone()[0]
+    if not msg_count and not skipped and not resumed and not failed:
+        con.close()
+        print("[!] No messages found in export")
+        return
+    
+    if shard_by:
+        total = shards.message_count(con, list(shards.load_layout(con)[1].values()))
+    else:
+        total = cur.execute("SELECT count(*) FROM messages").fetchone()[0]
     con.close()
     
+    print(f"[+] Parsed {msg_count} messages from {thread_count} threads")
+    if skipped:
+        print(f"[+] Skipped {skipped} unchanged threads ({skipped_messages} messages)")
+    if resumed:
+        print(f"[+] Fast-forwarded past {resumed} threads "
+              f"({sum(s['messages_resumed'] for s in stats)} messages) committed before the interruption")
+    if args.dedup_bodies:
+        stored = sum(s["bodies_stored"] for s in stats)
+        shared = sum(s["bodies_shared"] for s in stats)
+        print(f"[+] Bodies: {stored} stored, {shared} repeats pointed at existing bodies")
     print(f"\n[+] Complete!")
+    if len(jobs) > 1:
+        print(f"  Files: {len(jobs) - len(failed)} ingested, {len(failed)} failed")
     print(f"  Inserted: {ins_count}")
     print(f"  Duplicates skipped: {dup_count}")
     print(f"  Total messages in DB: {total}")
+    print(f"  Elapsed: {elapsed:.2f}s ({msg_count / elapsed if elapsed else 0:,.0f} rows/sec)")
+    
+    if failed:
+        if len(jobs) == 1:
+            raise SystemExit(stats[0]["error"])
+        raise SystemExit(f"[ERROR] {len(failed)} file(s) failed: {', '.join(failed)}")
 
 if __name__ == "__main__":
     main()
-
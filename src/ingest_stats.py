@@ -0,0 +1,117 @@
+# ingest_stats.py
+# Per-stage timings and counters for ingest.py
+# Stats are plain dicts so they can cross process boundaries and be summed
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Seconds spent per stage; "hash" and "parse" are summed across processes,
+# "lock" is time spent waiting for other writers to release the database
+STAGES = ("parse", "manifest", "hash", "compress", "bodies", "insert", "threads", "fts", "lock",
+          "commit", "checkpoint")
+
+COUNTERS = (
+    "messages_parsed",
+    "threads_parsed",
+    "messages_hashed",
+    "inserted",
+    "duplicates",
+    "fts_rows",
+    "commits",
+    "bytes_read",
+    "threads_skipped",
+    "messages_skipped",
+    "bodies_stored",
+    "bodies_shared",
+    "threads_resumed",
+    "messages_resumed",
+)
+
+
+def new_stats() -> Dict:
+    """Zeroed stage timings and counters."""
+    stats = {f"{stage}_seconds": 0.0 for stage in STAGES}
+    stats.update({name: 0 for name in COUNTERS})
+    return stats
+
+
+def merge_stats(into: Dict, other: Dict):
+    """Add every numeric stat in other to into."""
+    for key, value in other.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            into[key] = into.get(key, 0) + value
+
+
+def sum_stats(items: Iterable[Dict]) -> Dict:
+    total = new_stats()
+    for item in items:
+        merge_stats(total, item)
+    return total
+
+
+@contextmanager
+def timed(stats: Optional[Dict], stage: str):
+    """Add the wall time of the block to stats['<stage>_seconds']; no-op if stats is None."""
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[f"{stage}_seconds"] += time.perf_counter() - start
+
+
+def timed_iter(iterable: Iterable, stats: Dict, stage: str, counter: str) -> Iterator:
+    """Yield from iterable, charging time spent producing each item to stage."""
+    it = iter(iterable)
+    key = f"{stage}_seconds"
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            stats[key] += time.perf_counter() - start
+            return
+        stats[key] += time.perf_counter() - start
+        stats[counter] += 1
+        yield item
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process and its reaped children, in MB."""
+    if resource is None:
+        return None
+    # ru_maxrss is KB on Linux, bytes on macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / divisor, 1)
+
+
+def progress_line(elapsed: float, messages: int, inserted: int, bytes_read: Optional[int]) -> str:
+    """One periodic progress line with rates."""
+    rate = messages / elapsed if elapsed else 0
+    line = (f"  [progress] {elapsed:.0f}s: {messages:,} messages ({rate:,.0f}/s), "
+            f"{inserted:,} inserted")
+    if bytes_read:
+        line += f", {bytes_read / 1e6:,.1f} MB read ({bytes_read / 1e6 / elapsed if elapsed else 0:,.1f} MB/s)"
+    return line
+
+
+def write_report(path: str, report: Dict, stream=None):
+    """Write a stats report as JSON; '-' writes to stream (default stdout)."""
+    text = json.dumps(report, indent=2)
+    if path == "-":
+        print(text, file=stream or sys.stdout)
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
@@ -2,8 +2,9 @@
 # Parser for Anthropic Claude conversation exports
 # Returns normalized Message dictionaries
 
-import json
-from typing import List, Dict, Iterator
+import ijson
+from . import source
+from typing import List, Dict, Iterator, Optional
 from datetime import datetime
 
 def parse(input_path: str) -> Iterator[Dict]:
@@ -16,24 +17,34 @@ def parse(input_path: str) -> Iterator[Dict]:
     - role: str (user, assistant, system)
     - content: str
     - created_at: float (epoch timestamp)
+    - thread_updated_at: float or None (the conversation's updated_at)
     """
-    with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
-        try:
-            data = json.load(f)
-        except Exception as e:
-            raise SystemExit(f"[ERROR] Invalid JSON: {e}")
-    
     # Anthropic exports are an array of conversations
-    if not isinstance(data, list):
+    first = source.read_head(input_path)
+    if first.lstrip()[:1] != "[":
         raise SystemExit("[ERROR] Anthropic export should be a JSON array")
     
-    for convo in data:
-        yield from _parse_conversation(convo)
+    # Stream array items so each conversation is yielded as soon as it is read
+    with source.open_binary(input_path) as f:
+        try:
+            for convo in ijson.items(f, "item", use_float=True):
+                if isinstance(convo, dict):
+                    yield from _parse_conversation(convo)
+        except ijson.JSONError as e:
+            raise SystemExit(f"[ERROR] Invalid JSON: {e}")
+
+def _parse_iso(value) -> Optional[float]:
+    """Epoch seconds of an ISO timestamp like "2025-10-17T06:49:48.665364Z", or None."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (ValueError, TypeError, AttributeError):
+        return None
 
 def _parse_conversation(convo: Dict) -> Iterator[Dict]:
     """Parse a single Anthropic conversation."""
     thread_id = convo.get("uuid", "")
     title = convo.get("name", "")
+    updated_at = _parse_iso(convo.get("updated_at"))
     chat_messages = convo.get("chat_messages", [])
     
     for msg in chat_messages:
@@ -62,19 +73,14 @@ def _parse_conversation(convo: Dict) -> Iterator[Dict]:
             content = text
         
         # Parse timestamp
-        created_at_str = msg.get("created_at", "")
-        try:
-            # Anthropic uses ISO format like "2025-10-17T06:49:48.665364Z"
-            dt = datetime.fromisoformat(created_at_str.replace("Z", "+00:00"))
-            created_at = dt.timestamp()
-        except (ValueError, TypeError, AttributeError):
-            created_at = 0.0
+        created_at = _parse_iso(msg.get("created_at", "")) or 0.0
         
         yield {
             "thread_id": thread_id,
             "thread_title": title,
             "role": role,
             "content": content,
-            "created_at": created_at
+            "created_at": created_at,
+            "thread_updated_at": updated_at
         }
 
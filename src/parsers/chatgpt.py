@@ -3,8 +3,9 @@
 # Returns normalized Message dictionaries
 
 import ijson
+from . import source
 import json
-from typing import List, Dict, Iterator
+from typing import List, Dict, Iterator, Optional
 
 def extract_text_from_content(content):
     """Extract text from ChatGPT's content structure."""
@@ -19,7 +20,7 @@ def extract_text_from_content(content):
             out.append(p)
     return "\n".join([t for t in out if t])
 
-def parse(input_path: str) -> Iterator[Dict]:
+def parse(input_path: str, include_branches: bool = False) -> Iterator[Dict]:
     """
     Parse ChatGPT export and yield normalized messages.
     
@@ -29,63 +30,141 @@ def parse(input_path: str) -> Iterator[Dict]:
     - role: str (user, assistant, system)
     - content: str
     - created_at: float (epoch timestamp)
+    - thread_updated_at: float or None (the conversation's update_time)
+    
+    Conversations with a current_node also set message_ref, parent_ref and
+    is_canonical; alternate branches are only emitted with include_branches.
     """
     # Check if array or single object
-    with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
-        first = f.read(4096)
+    first = source.read_head(input_path)
     start = first.lstrip()[:1]
     
     if start == "[":
         # Stream array items
-        with open(input_path, "rb") as f:
-            for convo in ijson.items(f, "item"):
-                if isinstance(convo, dict):
-                    yield from _parse_conversation(convo)
+        with source.open_binary(input_path) as f:
+            try:
+                for convo in ijson.items(f, "item"):
+                    if isinstance(convo, dict):
+                        yield from _parse_conversation(convo, include_branches)
+            except ijson.JSONError as e:
+                raise SystemExit(f"[ERROR] Invalid JSON: {e}")
     elif start == "{":
         # Single object
-        with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
+        with source.open_binary(input_path) as f:
             try:
-                obj = json.load(f)
+                obj = json.loads(f.read().decode("utf-8", errors="ignore"))
             except Exception as e:
                 raise SystemExit(f"[ERROR] Invalid JSON: {e}")
         if isinstance(obj, dict):
-            yield from _parse_conversation(obj)
+            yield from _parse_conversation(obj, include_branches)
         else:
             raise SystemExit("[ERROR] Unexpected JSON structure")
     else:
         raise SystemExit("[ERROR] File doesn't look like JSON")
 
-def _parse_conversation(convo: Dict) -> Iterator[Dict]:
-    """Parse a single ChatGPT conversation."""
+def _node_message(node: Dict, thread_id: str, title: str,
+                  updated_at: Optional[float]) -> Optional[Dict]:
+    """Normalize one mapping node, or None if it carries no timestamped message."""
+    m = node.get("message")
+    if not m:
+        return None
+    
+    role = (m.get("author") or {}).get("role") or ""
+    content_obj = m.get("content") or {}
+    content = extract_text_from_content(content_obj)
+    
+    ts = m.get("create_time") or m.get("update_time")
+    if not ts:
+        return None
+    
+    return {
+        "thread_id": thread_id,
+        "thread_title": title,
+        "role": role,
+        "content": content,
+        "created_at": float(ts),
+        "thread_updated_at": updated_at
+    }
+
+def _parse_conversation(convo: Dict, include_branches: bool = False) -> Iterator[Dict]:
+    """
+    Parse a single ChatGPT conversation.
+    
+    The mapping is a tree of edits and regenerations. The canonical thread
+    is the path from the root to current_node, found by walking parent
+    links up from current_node in O(n) and emitted in order. With
+    include_branches, nodes off that path are emitted too, marked
+    is_canonical=False. Every message carries message_ref (its node ID),
+    parent_ref (the node ID of its nearest emitted ancestor) and
+    thread_anchor (the earliest message anywhere in the mapping).
+    """
     thread_id = convo.get("id") or convo.get("conversation_id", "")
     title = convo.get("title", "")
-    mapping = convo.get("mapping", {})
+    updated_at = float(convo["update_time"]) if convo.get("update_time") else None
+    mapping = convo.get("mapping") or {}
+    current = convo.get("current_node")
     
-    messages = []
-    for node_id, node in mapping.items():
-        m = node.get("message")
-        if not m:
-            continue
-        
-        role = (m.get("author") or {}).get("role") or ""
-        content_obj = m.get("content") or {}
-        content = extract_text_from_content(content_obj)
-        
-        ts = m.get("create_time") or m.get("update_time")
-        if not ts:
-            continue
-        
-        messages.append({
-            "thread_id": thread_id,
-            "thread_title": title,
-            "role": role,
-            "content": content,
-            "created_at": float(ts)
-        })
+    if current not in mapping:
+        # No usable tree pointer: fall back to every node in timestamp order
+        messages = [msg for msg in (_node_message(node, thread_id, title, updated_at)
+                                    for node in mapping.values()) if msg]
+        messages.sort(key=lambda x: x["created_at"])
+        yield from messages
+        return
+    
+    # The thread ID has always come from the earliest message in the whole
+    # mapping; keep it that way even when that message is an edited-away branch
+    nodes = {node_id: _node_message(node, thread_id, title, updated_at) for node_id, node in mapping.items()}
+    dated = [msg for msg in nodes.values() if msg]
+    earliest = dict(min(dated, key=lambda x: x["created_at"])) if dated else None
     
-    # Sort by timestamp
-    messages.sort(key=lambda x: x["created_at"])
+    # Walk up from the leaf the user last saw, then reverse
+    path = []
+    seen = set()
+    node_id = current
+    while node_id in mapping and node_id not in seen:
+        seen.add(node_id)
+        path.append(node_id)
+        node_id = mapping[node_id].get("parent")
+    path.reverse()
     
-    for msg in messages:
+    # Nearest emitted ancestor of each canonical node, for branch parents
+    emitted_parent = {}
+    emitted = set()
+    parent_ref = None
+    for node_id in path:
+        emitted_parent[node_id] = parent_ref
+        msg = nodes[node_id]
+        if not msg:
+            continue
+        msg["message_ref"] = node_id
+        msg["parent_ref"] = parent_ref
+        msg["is_canonical"] = True
+        msg["thread_anchor"] = earliest
+        parent_ref = node_id
+        emitted.add(node_id)
         yield msg
-
+    
+    if not include_branches:
+        return
+    
+    # Depth-first over subtrees hanging off the canonical path
+    for anchor in path:
+        anchor_ref = anchor if anchor in emitted else emitted_parent[anchor]
+        stack = [(child, anchor_ref) for child in reversed(mapping[anchor].get("children") or [])
+                 if child not in seen]
+        while stack:
+            node_id, parent_ref = stack.pop()
+            if node_id in seen or node_id not in mapping:
+                continue
+            seen.add(node_id)
+            node = mapping[node_id]
+            msg = nodes[node_id]
+            if msg:
+                msg["message_ref"] = node_id
+                msg["parent_ref"] = parent_ref
+                msg["is_canonical"] = False
+                msg["thread_anchor"] = earliest
+                parent_ref = node_id
+                yield msg
+            stack.extend((child, parent_ref) for child in reversed(node.get("children") or []))
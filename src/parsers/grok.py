@@ -2,7 +2,8 @@
 # Parser for Grok (X.AI) conversation exports
 # Returns normalized Message dictionaries
 
-import json
+import ijson
+from . import source
 from typing import List, Dict, Iterator
 from datetime import datetime
 
@@ -16,21 +17,36 @@ def parse(input_path: str) -> Iterator[Dict]:
     - role: str (user, assistant, system)
     - content: str
     - created_at: float (epoch timestamp)
+    - thread_updated_at: float or None (the conversation's modify_time)
     """
-    with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
+    # Grok exports are an object with a 'conversations' key
+    first = source.read_head(input_path)
+    if first.lstrip()[:1] != "{":
+        raise SystemExit("[ERROR] Grok export should have 'conversations' key")
+    
+    # Stream conversation wrappers one at a time on ijson's fast items path
+    found = False
+    with source.open_binary(input_path) as f:
         try:
-            data = json.load(f)
-        except Exception as e:
+            for conv_wrapper in ijson.items(f, "conversations.item", use_float=True):
+                found = True
+                if isinstance(conv_wrapper, dict):
+                    yield from _parse_conversation(conv_wrapper)
+        except ijson.JSONError as e:
             raise SystemExit(f"[ERROR] Invalid JSON: {e}")
     
-    # Grok exports have a 'conversations' key
-    if not isinstance(data, dict) or "conversations" not in data:
+    # Only an export with no conversations needs a second look for the key
+    if not found and not _has_conversations(input_path):
         raise SystemExit("[ERROR] Grok export should have 'conversations' key")
-    
-    conversations = data["conversations"]
-    
-    for conv_wrapper in conversations:
-        yield from _parse_conversation(conv_wrapper)
+
+def _has_conversations(input_path: str) -> bool:
+    """Whether the top-level object has a 'conversations' key."""
+    with source.open_binary(input_path) as f:
+        try:
+            return any(prefix == "" and event == "map_key" and value == "conversations"
+                       for prefix, event, value in ijson.parse(f))
+        except ijson.JSONError as e:
+            raise SystemExit(f"[ERROR] Invalid JSON: {e}")
 
 def _parse_conversation(conv_wrapper: Dict) -> Iterator[Dict]:
     """Parse a single Grok conversation wrapper."""
@@ -39,6 +55,7 @@ def _parse_conversation(conv_wrapper: Dict) -> Iterator[Dict]:
     
     thread_id = conversation.get("id", "")
     title = conversation.get("title", "")
+    updated_at = _parse_time(conversation.get("modify_time")) or None
     
     for resp_wrapper in responses:
         resp = resp_wrapper.get("response", {})
@@ -60,33 +77,33 @@ def _parse_conversation(conv_wrapper: Dict) -> Iterator[Dict]:
         content = resp.get("message", "")
         
         # Parse timestamp - Grok uses MongoDB-style date format
-        create_time = resp.get("create_time", {})
-        
-        if isinstance(create_time, dict):
-            # MongoDB format: {"$date": {"$numberLong": "1754341171713"}}
-            date_val = create_time.get("$date", {})
-            if isinstance(date_val, dict):
-                number_long = date_val.get("$numberLong", "0")
-                created_at = float(number_long) / 1000.0  # Convert ms to seconds
-            elif isinstance(date_val, str):
-                # ISO format
-                try:
-                    dt = datetime.fromisoformat(date_val.replace("Z", "+00:00"))
-                    created_at = dt.timestamp()
-                except (ValueError, TypeError, AttributeError):
-                    created_at = 0.0
-            else:
-                created_at = 0.0
-        elif isinstance(create_time, (int, float)):
-            created_at = float(create_time)
-        else:
-            created_at = 0.0
+        created_at = _parse_time(resp.get("create_time", {}))
         
         yield {
             "thread_id": thread_id,
             "thread_title": title,
             "role": role,
             "content": content,
-            "created_at": created_at
+            "created_at": created_at,
+            "thread_updated_at": updated_at
         }
 
+def _parse_time(value) -> float:
+    """Epoch seconds of a Grok timestamp (MongoDB date, ISO string or number), or 0.0."""
+    if isinstance(value, dict):
+        # MongoDB format: {"$date": {"$numberLong": "1754341171713"}}
+        date_val = value.get("$date", {})
+        if isinstance(date_val, dict):
+            number_long = date_val.get("$numberLong", "0")
+            return float(number_long) / 1000.0  # Convert ms to seconds
+        value = date_val
+    if isinstance(value, str):
+        # ISO format
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except (ValueError, TypeError, AttributeError):
+            return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    return 0.0
+
@@ -0,0 +1,124 @@
+# source.py
+# Opens export inputs for the parsers: plain files or members of ZIP archives
+# A ZIP member is addressed as "path/to/export.zip!member/name.json"
+
+import hashlib
+import os
+import zipfile
+from typing import List, Optional, Tuple
+
+ARCHIVE_SEP = "!"
+
+# Bytes hashed from each end of a plain file to recognise it on --resume
+IDENTITY_BYTES = 1024 * 1024
+
+def split_archive_path(input_path: str) -> Tuple[str, Optional[str]]:
+    """Split "export.zip!member.json" into (zip path, member); plain paths give (path, None)."""
+    lowered = input_path.lower()
+    marker = ".zip" + ARCHIVE_SEP
+    pos = lowered.find(marker)
+    if pos == -1:
+        return input_path, None
+    archive = input_path[:pos + 4]
+    if not os.path.isfile(archive):
+        return input_path, None
+    return archive, input_path[pos + len(marker):]
+
+def archive_members(zip_path: str) -> List[str]:
+    """List the JSON members of a ZIP archive as parser input paths."""
+    with zipfile.ZipFile(zip_path) as zf:
+        names = [
+            info.filename for info in zf.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith(".json")
+            and not info.filename.startswith("__MACOSX/")
+        ]
+    return [f"{zip_path}{ARCHIVE_SEP}{name}" for name in sorted(names)]
+
+# Bytes handed to parsers by this process, across all inputs
+_bytes_read = 0
+
+def bytes_read() -> int:
+    """Total bytes read through open_binary() streams in this process."""
+    return _bytes_read
+
+class CountingReader:
+    """Binary stream wrapper that counts bytes as they are read."""
+
+    def __init__(self, raw, on_close=None):
+        self._raw = raw
+        self._on_close = on_close
+
+    def read(self, size=-1):
+        global _bytes_read
+        data = self._raw.read(size)
+        _bytes_read += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self._raw.closed
+
+    def close(self):
+        self._raw.close()
+        if self._on_close:
+            self._on_close()
+            self._on_close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_binary(input_path: str) -> CountingReader:
+    """
+    Open an export for binary streaming.
+
+    ZIP members are decompressed on the fly as the caller reads, so the
+    archive never has to be extracted to disk.
+    """
+    archive, member = split_archive_path(input_path)
+    if member is None:
+        return CountingReader(open(input_path, "rb"))
+    zf = zipfile.ZipFile(archive)
+    try:
+        stream = zf.open(member)
+    except KeyError:
+        zf.close()
+        raise SystemExit(f"[ERROR] {member} not found in {archive}")
+    # Close the archive together with the member stream
+    return CountingReader(stream, on_close=zf.close)
+
+def read_head(input_path: str, size: int = 4096) -> str:
+    """Return the first bytes of an export as text, for structure checks."""
+    with open_binary(input_path) as f:
+        return f.read(size).decode("utf-8", errors="ignore")
+
+def identity(input_path: str) -> Optional[str]:
+    """
+    Cheap fingerprint of an export's contents, or None if it can't be read.
+
+    Plain files use their size and a hash of the first and last
+    IDENTITY_BYTES; ZIP members use the size and CRC from the archive's
+    directory, so nothing is decompressed.
+    """
+    archive, member = split_archive_path(input_path)
+    try:
+        if member is not None:
+            with zipfile.ZipFile(archive) as zf:
+                info = zf.getinfo(member)
+            return f"zip:{info.file_size}:{info.CRC:08x}"
+        size = os.path.getsize(input_path)
+        h = hashlib.blake2b(digest_size=16)
+        with open(input_path, "rb") as f:
+            h.update(f.read(IDENTITY_BYTES))
+            if size > IDENTITY_BYTES:
+                f.seek(max(IDENTITY_BYTES, size - IDENTITY_BYTES))
+                h.update(f.read())
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+    return f"{size}:{h.hexdigest()}"
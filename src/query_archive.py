@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+query_archive.py
+Full-text search and thread lookup across an archive, sharded or not
+"""
+
+import argparse
+import shards
+from ingest import BUSY_TIMEOUT, require_schema
+
+
+def print_search(results, order: str):
+    if not results:
+        print("[!] No matches found")
+        return
+    print(f"[+] {len(results)} matches (ordered by {order}):\n")
+    for i, row in enumerate(results, 1):
+        print(f"{i}. [{row['platform']}] {row['ts']}  {(row['title'] or '(no title)')[:60]}")
+        if order == "rank":
+            print(f"   bm25: {row['rank']:.3f}")
+        print(f"   {row['role']}: {row['text'][:200].replace(chr(10), ' ')}")
+        print(f"   Thread: {row['canonical_thread_id']}")
+        if row["copies"] > 1:
+            print(f"   (same text in {row['copies'] - 1} other message(s))")
+        print()
+
+
+def print_thread(thread, messages):
+    if not thread:
+        print("[!] Thread not found")
+        return
+    print(f"[+] {thread['title'] or '(no title)'} ({thread['platform']}, "
+          f"{thread['message_count']} messages, {thread['first_ts']} to {thread['last_ts']})\n")
+    for msg in messages:
+        branch = "" if msg["is_canonical"] else " (branch)"
+        print(f"[{msg['ts']}] {msg['role']}{branch}:")
+        print(f"  {msg['text'][:500]}")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Search an archive; sharded archives are queried across all shards",
+        epilog='Example: python src/query_archive.py "vector database" --db archive.sqlite --order rank'
+    )
+    parser.add_argument("query", nargs="?", help="FTS5 query (omit to list recent threads)")
+    parser.add_argument("--db", required=True, help="Path to SQLite database (the catalog for sharded archives)")
+    parser.add_argument("--order", choices=shards.SEARCH_ORDERS, default="ts",
+                        help="Merge results by timestamp (newest first) or bm25 rank")
+    parser.add_argument("--platform", help="Only search this platform")
+    parser.add_argument("--limit", type=int, default=20, help="Number of results")
+    parser.add_argument("--thread", help="Show every message of this canonical_thread_id")
+
+    args = parser.parse_args()
+
+    con, paths = shards.open_archive(args.db, BUSY_TIMEOUT)
+    require_schema(con, args.db)
+    if len(paths) > 1 or paths[0] != args.db:
+        print(f"[*] Querying {len(paths)} shard(s)\n")
+
+    if args.thread:
+        print_thread(*shards.get_thread(con, paths, args.thread))
+    elif args.query:
+        print_search(shards.search(con, paths, args.query, args.limit, args.order, args.platform),
+                     args.order)
+    else:
+        threads = shards.list_threads(con, paths, args.limit, args.platform)
+        print(f"[+] {len(threads)} most recent threads:\n")
+        for t in threads:
+            print(f"{t['last_ts']}  [{t['platform']}] {t['message_count']:>5} msgs  "
+                  f"{(t['title'] or '(no title)')[:50]}  {t['canonical_thread_id']}")
+
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
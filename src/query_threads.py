@@ -8,6 +8,19 @@ import argparse
 from qdrant_client import QdrantClient
 from sentence_transformers import SentenceTransformer
 
+# Chunk hits fetched per requested thread before grouping by thread
+CHUNK_HITS_PER_THREAD = 10
+
+
+def best_chunk_per_thread(results, limit: int):
+    """Keep each thread's highest-scoring chunk (max pooling), best threads first."""
+    best = {}
+    for result in results:
+        thread_id = result.payload['thread_id']
+        if thread_id not in best or result.score > best[thread_id].score:
+            best[thread_id] = result
+    return sorted(best.values(), key=lambda r: r.score, reverse=True)[:limit]
+
 
 def main():
     parser = argparse.ArgumentParser(description="Query conversation threads in Qdrant")
@@ -17,6 +30,9 @@ def main():
     parser.add_argument("--port", type=int, default=6335, help="Qdrant port")
     parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Embedding model")
     parser.add_argument("--limit", type=int, default=3, help="Number of results")
+    parser.add_argument("--chunks", action="store_true",
+                        help="Search the chunk collection written by vectorize_threads.py --chunk "
+                             "and rank threads by their best-matching chunk")
 
     args = parser.parse_args()
 
@@ -33,11 +49,18 @@ def main():
     query_vector = model.encode(args.query).tolist()
 
     # Search
-    results = client.query_points(
-        collection_name=args.collection,
-        query=query_vector,
-        limit=args.limit
-    ).points
+    if args.chunks:
+        results = best_chunk_per_thread(client.query_points(
+            collection_name=f"{args.collection}-chunks",
+            query=query_vector,
+            limit=args.limit * CHUNK_HITS_PER_THREAD
+        ).points, args.limit)
+    else:
+        results = client.query_points(
+            collection_name=args.collection,
+            query=query_vector,
+            limit=args.limit
+        ).points
 
     print(f"[+] Found {len(results)} relevant conversation threads:\n")
     print("=" * 80)
@@ -48,8 +71,12 @@ def main():
         print(f"Platform: {result.payload['platform']}")
         print(f"Messages: {result.payload['message_count']}")
         print(f"Time range: {result.payload['first_timestamp']} to {result.payload['last_timestamp']}")
-        print(f"\nPreview:")
-        print(result.payload['preview'])
+        if args.chunks:
+            print(f"\nBest match (chunk {result.payload['chunk_index'] + 1} of {result.payload['chunk_count']}):")
+            print(result.payload['text'][:500])
+        else:
+            print(f"\nPreview:")
+            print(result.payload['preview'])
         print("=" * 80)
 
 
@@ -5,34 +5,34 @@ Query Qdrant and enrich results with full context from SQLite
 """
 
 import argparse
-import sqlite3
 from qdrant_client import QdrantClient
 from sentence_transformers import SentenceTransformer
+import shards
+from ingest import BUSY_TIMEOUT, require_schema
 
 
-def get_thread_context(db_path: str, qdrant_id: int, collection_name: str) -> dict:
+def get_thread_context(db_path: str, qdrant_id: str, collection_name: str) -> dict:
     """Get full thread context from SQLite using Qdrant ID."""
-    con = sqlite3.connect(db_path)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
-
-    # Get thread info from mapping
-    cur.execute("""
-        SELECT
-            qt.canonical_thread_id,
-            m.platform,
-            m.title,
-            m.account_id,
-            MIN(m.ts) as first_timestamp,
-            MAX(m.ts) as last_timestamp,
-            COUNT(m.message_id) as message_count
-        FROM qdrant_threads qt
-        JOIN messages m ON qt.canonical_thread_id = m.canonical_thread_id
-        WHERE qt.qdrant_id = ? AND qt.collection_name = ?
-        GROUP BY qt.canonical_thread_id, m.platform, m.title, m.account_id
-    """, (qdrant_id, collection_name))
-
-    result = cur.fetchone()
+    con, paths = shards.open_archive(db_path, BUSY_TIMEOUT)
+
+    # Get thread info from mapping; the thread lives in exactly one shard
+    result = None
+    for schema in shards.iter_attached(con, paths):
+        result = con.execute(f"""
+            SELECT
+                qt.canonical_thread_id,
+                t.platform,
+                t.title,
+                t.account_id,
+                t.first_ts as first_timestamp,
+                t.last_ts as last_timestamp,
+                t.message_count
+            FROM main.qdrant_threads qt
+            JOIN {schema}.threads t ON qt.canonical_thread_id = t.canonical_thread_id
+            WHERE qt.qdrant_id = ? AND qt.collection_name = ?
+        """, (qdrant_id, collection_name)).fetchone()
+        if result:
+            break
     con.close()
 
     return dict(result) if result else None
@@ -52,6 +52,11 @@ def main():
 
     args = parser.parse_args()
 
+    # Fail before loading the model if the archive is missing or out of date
+    con, _ = shards.open_archive(args.db, BUSY_TIMEOUT)
+    require_schema(con, args.db)
+    con.close()
+
     # Load model
     print(f"[*] Loading model: {args.model}")
     model = SentenceTransformer(args.model)
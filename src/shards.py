@@ -0,0 +1,287 @@
+# shards.py
+# Optional sharded archive layout: messages split across per-platform or
+# per-year SQLite files, each with its own messages_fts and threads tables.
+# The --db file is the catalog: it keeps the import manifest and a shards
+# table listing the shard files. Queries ATTACH the shards and fan out.
+
+import heapq
+import os
+import re
+import sqlite3
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import compression
+
+SHARD_BY = ("platform", "year")
+
+# SQLite's compile-time default; newer Pythons can ask the connection
+DEFAULT_MAX_ATTACHED = 10
+
+SEARCH_ORDERS = ("ts", "rank")
+
+
+def shard_key(shard_by: str, platform: str, ts: str) -> str:
+    """Shard a thread belongs to, from its platform or its first message's year."""
+    if shard_by == "platform":
+        return re.sub(r"[^A-Za-z0-9_-]+", "_", platform) or "unknown"
+    year = (ts or "")[:4]
+    return year if year.isdigit() else "unknown"
+
+
+def shard_path(db_path: str, key: str) -> str:
+    """Shard file next to the catalog: archive.sqlite -> archive.<key>.sqlite."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.{key}{ext or '.sqlite'}"
+
+
+def ensure_catalog(cur):
+    """Create the shards table in a catalog database."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS shards (
+          shard_key TEXT PRIMARY KEY,
+          shard_by TEXT NOT NULL,
+          path TEXT NOT NULL
+        )
+    """)
+
+
+def load_layout(con) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    Return (shard_by, {shard_key: absolute path}) for a catalog.
+
+    shard_by is None for an unsharded archive. Paths are stored relative to
+    the catalog so the archive directory can be moved as a whole.
+    """
+    ensure_catalog(con.cursor())
+    rows = con.execute("SELECT shard_key, shard_by, path FROM shards ORDER BY shard_key").fetchall()
+    if not rows:
+        return None, {}
+    by = {row[1] for row in rows}
+    if len(by) > 1:
+        raise SystemExit(f"[ERROR] Catalog mixes shard layouts: {', '.join(sorted(by))}")
+    base = os.path.dirname(os.path.abspath(catalog_path(con)))
+    return rows[0][1], {key: os.path.join(base, path) for key, _, path in rows}
+
+
+def catalog_path(con) -> str:
+    """File behind a connection's main database."""
+    for _, name, path in con.execute("PRAGMA database_list"):
+        if name == "main":
+            return path
+    return ""
+
+
+class ShardRouter:
+    """
+    Hands out one writer connection per shard, opening shards on first use.
+
+    prepare(path) creates or upgrades a shard's schema; on_open(con) lets
+    the caller apply PRAGMAs or begin a transaction on each new connection.
+    Connections wait up to timeout seconds for other processes' locks.
+    """
+
+    def __init__(self, db_path: str, catalog, shard_by: str,
+                 prepare: Callable[[str], None],
+                 on_open: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 timeout: float = 5.0):
+        self.db_path = db_path
+        self.catalog = catalog
+        self.shard_by = shard_by
+        self.prepare = prepare
+        self.on_open = on_open
+        self.timeout = timeout
+        self.connections: Dict[str, sqlite3.Connection] = {}
+
+    def connection(self, platform: str, rows: List[Tuple]) -> sqlite3.Connection:
+        """Connection for a thread's rows; a thread is never split across shards."""
+        key = shard_key(self.shard_by, platform, rows[0][4] if rows else "")
+        con = self.connections.get(key)
+        if con is None:
+            con = self._open(key)
+        return con
+
+    def _open(self, key: str) -> sqlite3.Connection:
+        path = shard_path(self.db_path, key)
+        self.prepare(path)
+        in_transaction = self.catalog.in_transaction
+        self.catalog.execute("INSERT OR IGNORE INTO shards (shard_key, shard_by, path) VALUES (?,?,?)",
+                             (key, self.shard_by, os.path.basename(path)))
+        if not in_transaction:
+            self.catalog.commit()
+        con = sqlite3.connect(path, timeout=self.timeout)
+        if self.on_open:
+            self.on_open(con)
+        self.connections[key] = con
+        return con
+
+    def close(self):
+        for con in self.connections.values():
+            con.close()
+        self.connections = {}
+
+
+def open_archive(db_path: str, timeout: float = 5.0) -> Tuple[sqlite3.Connection, List[str]]:
+    """
+    Connect to an archive for reading, returning (connection, shard paths).
+
+    For an unsharded archive the only "shard" is the catalog file itself.
+    In WAL mode reads never wait on an ingest's write transaction; timeout
+    only matters while a writer holds an exclusive lock or checkpoints.
+    """
+    if not os.path.exists(db_path):
+        raise SystemExit(f"[ERROR] Database not found: {db_path}")
+    con = sqlite3.connect(db_path, timeout=timeout)
+    con.row_factory = sqlite3.Row
+    _, layout = load_layout(con)
+    return con, list(layout.values()) or [db_path]
+
+
+def open_shard(db_path: str, path: str, timeout: float = 5.0,
+               check_same_thread: bool = True) -> Tuple[sqlite3.Connection, str]:
+    """
+    Connect to one shard for reading, with the catalog's tables reachable too.
+
+    Returns (connection, catalog schema): "main" when path is the catalog
+    itself, otherwise the catalog is ATTACHed as "catalog".
+    """
+    if not os.path.exists(path):
+        raise SystemExit(f"[ERROR] Shard missing: {path}")
+    con = sqlite3.connect(path, timeout=timeout, check_same_thread=check_same_thread)
+    con.row_factory = sqlite3.Row
+    if os.path.abspath(path) == os.path.abspath(db_path):
+        return con, "main"
+    con.execute("ATTACH DATABASE ? AS catalog", (db_path,))
+    return con, "catalog"
+
+
+def max_attached(con) -> int:
+    try:
+        return con.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    except AttributeError:  # Python < 3.11
+        return DEFAULT_MAX_ATTACHED
+
+
+def iter_attached(con, paths: List[str]) -> Iterator[str]:
+    """
+    Yield a schema name for each shard, ATTACHing them in groups.
+
+    Shards are attached as many at a time as SQLite allows and detached
+    before the next group, so any number of shards can be queried. The
+    catalog itself is yielded as "main" when it is the only shard.
+    """
+    main = catalog_path(con)
+    group = max(1, max_attached(con))
+    for start in range(0, len(paths), group):
+        schemas = []
+        attached = []
+        try:
+            for i, path in enumerate(paths[start:start + group]):
+                if main and os.path.abspath(path) == os.path.abspath(main):
+                    schemas.append("main")
+                    continue
+                if not os.path.exists(path):
+                    raise SystemExit(f"[ERROR] Shard missing: {path}")
+                schema = f"shard{start + i}"
+                con.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                attached.append(schema)
+                schemas.append(schema)
+            yield from schemas
+        finally:
+            for schema in attached:
+                con.execute(f"DETACH DATABASE {schema}")
+
+
+def message_count(con, paths: List[str]) -> int:
+    """Total messages across shards."""
+    return sum(con.execute(f"SELECT count(*) FROM {schema}.messages").fetchone()[0]
+               for schema in iter_attached(con, paths))
+
+
+def search(con, paths: List[str], query: str, limit: int = 20, order: str = "ts",
+           platform: Optional[str] = None) -> List[Dict]:
+    """
+    Full-text search across shards, merged into one result list.
+
+    Each shard returns its own best `limit` rows, which are merged by ts
+    (newest first) or by bm25 rank. bm25 uses each shard's own term
+    statistics, so ranks across shards are comparable but not identical
+    to an unsharded index. A body shared through the bodies table is
+    indexed once; a match is reported as its first copy that passes the
+    platform filter, and `copies` counts every message carrying it.
+    """
+    if order not in SEARCH_ORDERS:
+        raise ValueError(f"order must be one of {SEARCH_ORDERS}")
+    sort = "m.ts DESC" if order == "ts" else "rank"
+    where = "AND c.platform = ?" if platform else ""
+    per_shard = []
+    for schema in iter_attached(con, paths):
+        # The FTS row belongs to the body's first message (h); report the
+        # first copy (m) that passes the filter
+        sql = f"""
+            SELECT m.message_id, m.canonical_thread_id, m.platform, m.ts, m.role,
+                   m.title, COALESCE(b.text, m.text) AS text, bm25(messages_fts) AS rank,
+                   CASE WHEN m.body_id IS NULL THEN 1 ELSE
+                     (SELECT count(*) FROM {schema}.messages c WHERE c.body_id = m.body_id) END AS copies
+            FROM {schema}.messages_fts
+            JOIN {schema}.messages_fts_docids d ON d.rowid = messages_fts.rowid
+            JOIN {schema}.messages h ON h.message_id = d.message_id
+            JOIN {schema}.messages m ON m.rowid = (
+                SELECT min(c.rowid) FROM {schema}.messages c
+                WHERE (c.rowid = h.rowid OR c.body_id = h.body_id) {where})
+            LEFT JOIN {schema}.bodies b ON b.body_id = m.body_id
+            WHERE messages_fts MATCH ?
+            ORDER BY {sort}
+            LIMIT ?
+        """
+        params = ([platform] if platform else []) + [query, limit]
+        rows = [dict(row) for row in con.execute(sql, params)]
+        if rows:
+            codec = compression.reader_codec(con, schema)
+            for row in rows:
+                row["text"] = compression.plain_text(row["text"], codec)
+        per_shard.append(rows)
+
+    if order == "ts":
+        merged = heapq.merge(*per_shard, key=lambda r: r["ts"], reverse=True)
+    else:
+        merged = heapq.merge(*per_shard, key=lambda r: r["rank"])
+    return list(islice(merged, limit))
+
+
+def get_thread(con, paths: List[str], thread_id: str) -> Tuple[Optional[Dict], List[Dict]]:
+    """Look up a thread and its messages in whichever shard holds it."""
+    schemas = iter_attached(con, paths)
+    try:
+        for schema in schemas:
+            row = con.execute(f"SELECT * FROM {schema}.threads WHERE canonical_thread_id = ?",
+                              (thread_id,)).fetchone()
+            if row:
+                messages = con.execute(f"""
+                    SELECT m.message_id, m.ts, m.role, COALESCE(b.text, m.text) AS text,
+                           m.parent_message_id, m.is_canonical
+                    FROM {schema}.messages m
+                    LEFT JOIN {schema}.bodies b ON b.body_id = m.body_id
+                    WHERE m.canonical_thread_id = ?
+                    ORDER BY m.ts
+                """, (thread_id,)).fetchall()
+                codec = compression.reader_codec(con, schema)
+                messages = [dict(m, text=compression.plain_text(m["text"], codec)) for m in messages]
+                return dict(row), messages
+    finally:
+        # Detach the current group even when returning early
+        schemas.close()
+    return None, []
+
+
+def list_threads(con, paths: List[str], limit: int = 20,
+                 platform: Optional[str] = None) -> List[Dict]:
+    """Most recently active threads across shards."""
+    where = "WHERE platform = ?" if platform else ""
+    per_shard = []
+    for schema in iter_attached(con, paths):
+        sql = f"SELECT * FROM {schema}.threads {where} ORDER BY last_ts DESC LIMIT ?"
+        params = ([platform] if platform else []) + [limit]
+        per_shard.append([dict(row) for row in con.execute(sql, params)])
+    merged = heapq.merge(*per_shard, key=lambda r: r["last_ts"], reverse=True)
+    return list(islice(merged, limit))
@@ -5,7 +5,8 @@ Show human-readable view of Qdrant ID mappings
 """
 
 import argparse
-import sqlite3
+import shards
+from ingest import BUSY_TIMEOUT, require_schema
 
 
 def main():
@@ -19,33 +20,28 @@ def main():
 
     args = parser.parse_args()
 
-    con = sqlite3.connect(args.db)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
+    # Mappings live in the catalog, thread metadata in whichever shard holds the thread
+    con, paths = shards.open_archive(args.db, BUSY_TIMEOUT)
+    require_schema(con, args.db)
+    where = "WHERE qt.collection_name = ?" if args.collection else ""
+    params = [args.collection] if args.collection else []
 
-    query = """
-        SELECT
-            qt.qdrant_id,
-            qt.collection_name,
-            m.platform,
-            m.title,
-            MIN(m.ts) as first_message,
-            MAX(m.ts) as last_message,
-            COUNT(m.message_id) as message_count
-        FROM qdrant_threads qt
-        JOIN messages m ON qt.canonical_thread_id = m.canonical_thread_id
-    """
-
-    params = []
-    if args.collection:
-        query += " WHERE qt.collection_name = ?"
-        params.append(args.collection)
-
-    query += " GROUP BY qt.qdrant_id, qt.collection_name, m.platform, m.title"
-    query += " ORDER BY qt.qdrant_id"
-
-    cur.execute(query, params)
-    results = cur.fetchall()
+    results = []
+    for schema in shards.iter_attached(con, paths):
+        results += con.execute(f"""
+            SELECT
+                qt.qdrant_id,
+                qt.collection_name,
+                t.platform,
+                t.title,
+                t.first_ts as first_message,
+                t.last_ts as last_message,
+                t.message_count
+            FROM main.qdrant_threads qt
+            JOIN {schema}.threads t ON qt.canonical_thread_id = t.canonical_thread_id
+            {where}
+        """, params).fetchall()
+    results.sort(key=lambda row: (row['collection_name'], row['first_message']))
 
     if not results:
         print("[!] No mappings found")
@@ -55,10 +51,10 @@ def main():
 
     if args.format == 'table':
         # Table format
-        print(f"{'ID':<4} {'Collection':<20} {'Platform':<12} {'Messages':<8} Title")
-        print("-" * 80)
+        print(f"{'ID':<36} {'Collection':<20} {'Platform':<12} {'Messages':<8} Title")
+        print("-" * 120)
         for row in results:
-            print(f"{row['qdrant_id']:<4} {row['collection_name']:<20} "
+            print(f"{row['qdrant_id']:<36} {row['collection_name']:<20} "
                   f"{row['platform']:<12} {row['message_count']:<8} {row['title'][:40]}")
     else:
         # List format (detailed)
@@ -0,0 +1,85 @@
+# vector_mapping.py
+# Deterministic Qdrant point IDs and the SQLite tables recording which
+# messages, threads and thread chunks are embedded in which collection. A
+# point's ID is a UUIDv5 of its message_id or canonical_thread_id (plus the
+# chunk index), so upserts are idempotent no matter the row order, batch
+# boundaries or uploader.
+
+import uuid
+
+# Fixed namespace: changing it would orphan every existing point
+NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "https://github.com/1ch1n/chat-export-structurer")
+
+
+def message_point_id(message_id: str) -> str:
+    """Qdrant point ID of a message's vector."""
+    return str(uuid.uuid5(NAMESPACE, f"message:{message_id}"))
+
+
+def thread_point_id(canonical_thread_id: str) -> str:
+    """Qdrant point ID of a thread's vector."""
+    return str(uuid.uuid5(NAMESPACE, f"thread:{canonical_thread_id}"))
+
+
+def chunk_point_id(canonical_thread_id: str, chunk_index: int) -> str:
+    """Qdrant point ID of one chunk of a thread."""
+    return str(uuid.uuid5(NAMESPACE, f"chunk:{canonical_thread_id}:{chunk_index}"))
+
+
+def ensure_mapping_tables(cur):
+    """Create the qdrant_messages, qdrant_threads and qdrant_chunks mapping tables."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS qdrant_messages (
+            message_id TEXT NOT NULL,
+            collection_name TEXT NOT NULL,
+            model TEXT NOT NULL,
+            qdrant_id TEXT NOT NULL,
+            indexed_at TEXT NOT NULL,
+            PRIMARY KEY (collection_name, message_id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS qdrant_threads (
+            qdrant_id TEXT NOT NULL,
+            canonical_thread_id TEXT NOT NULL,
+            collection_name TEXT NOT NULL,
+            indexed_at TEXT NOT NULL,
+            PRIMARY KEY (collection_name, canonical_thread_id)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_qdrant_threads_point ON qdrant_threads (collection_name, qdrant_id)")
+    # Character offsets are into vectorize_threads.thread_to_text() of the thread
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS qdrant_chunks (
+            qdrant_id TEXT NOT NULL,
+            canonical_thread_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            start_char INTEGER NOT NULL,
+            end_char INTEGER NOT NULL,
+            collection_name TEXT NOT NULL,
+            indexed_at TEXT NOT NULL,
+            PRIMARY KEY (collection_name, canonical_thread_id, chunk_index)
+        )
+    """)
+
+
+def upgrade_mapping_tables(cur):
+    """
+    Move mapping tables with sequential INTEGER point IDs to the TEXT layout.
+
+    Old rows are kept (their IDs stored as text) so lookups against
+    collections built before still work until they are rebuilt.
+    """
+    for table, columns in (
+        ("qdrant_threads", "qdrant_id, canonical_thread_id, collection_name, indexed_at"),
+        ("qdrant_messages", "message_id, collection_name, model, qdrant_id, indexed_at"),
+    ):
+        info = {row[1]: row[2].upper() for row in cur.execute(f"PRAGMA table_info({table})")}
+        if info.get("qdrant_id") != "INTEGER":
+            continue
+        cur.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        ensure_mapping_tables(cur)
+        cur.execute(f"""INSERT OR REPLACE INTO {table} ({columns})
+            SELECT {columns.replace('qdrant_id', 'CAST(qdrant_id AS TEXT)')} FROM {table}_old""")
+        cur.execute(f"DROP TABLE {table}_old")
+    ensure_mapping_tables(cur)
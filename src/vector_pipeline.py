@@ -0,0 +1,151 @@
+# vector_pipeline.py
+# Overlaps the three stages of a vectorizer run: a reader thread pulls
+# batches from SQLite ahead of time, the main thread encodes them, and
+# upload threads send the finished points to Qdrant. Point IDs are
+# deterministic (vector_mapping.py), so batches may land in any order and
+# a retried upsert cannot create duplicates.
+
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional
+
+# Batches read ahead of the encoder
+PREFETCH_BATCHES = 4
+# Batches encoded but not yet acknowledged by Qdrant
+IN_FLIGHT = 4
+UPLOAD_RETRIES = 3
+
+_DONE = object()
+
+
+def add_arguments(parser):
+    """Pipeline flags shared by the vectorizers."""
+    parser.add_argument("--in-flight", dest="in_flight", type=int, default=IN_FLIGHT,
+                        help=f"Batches uploading in the background while the next ones are encoded "
+                             f"(0 uploads inline; default: {IN_FLIGHT})")
+    parser.add_argument("--upload-retries", dest="upload_retries", type=int, default=UPLOAD_RETRIES,
+                        help=f"Retries for a failed upsert before giving up (default: {UPLOAD_RETRIES})")
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def prefetch(items: Iterable, depth: int = PREFETCH_BATCHES) -> Iterator:
+    """
+    Iterate items on a background thread, staying up to depth items ahead.
+
+    Errors raised by the producer are re-raised to the consumer. Closing
+    the generator early stops the producer at its next item.
+    """
+    buffer = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+        except BaseException as e:
+            buffer.put(e)
+        else:
+            buffer.put(_DONE)
+
+    thread = threading.Thread(target=produce, name="vectorize-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full buffer
+        while thread.is_alive():
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class Uploader:
+    """
+    Upserts batches of points on background threads.
+
+    submit() returns as soon as the batch is queued, blocking only while
+    `in_flight` batches are still unacknowledged. after_upload(points) runs
+    on the upload thread once Qdrant has accepted a batch, e.g. to record
+    the mapping. A batch that still fails after `retries` jittered
+    backoffs raises SystemExit from the next submit() or close().
+    """
+
+    def __init__(self, client, collection_name: str, in_flight: int = IN_FLIGHT,
+                 retries: int = UPLOAD_RETRIES, after_upload: Optional[Callable[[List], None]] = None):
+        self.client = client
+        self.collection_name = collection_name
+        self.in_flight = in_flight
+        self.retries = retries
+        self.after_upload = after_upload
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix="vectorize-upload") \
+            if in_flight > 0 else None
+        self.uploaded = 0
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def submit(self, points: List):
+        if not points:
+            return
+        if self.executor is None:
+            self._upload(points)
+            return
+        while len(self.pending) >= self.in_flight:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(self._upload, points))
+
+    def _upload(self, points: List):
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            try:
+                self.client.upsert(collection_name=self.collection_name, points=points)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise SystemExit(f"[ERROR] Upsert of {len(points)} points into {self.collection_name} "
+                                     f"failed after {self.retries} retries: {e}")
+                print(f"[!] Upsert of {len(points)} points failed ({e}); retrying in {delay:.0f}s")
+                with self.lock:
+                    self.retried += 1
+                time.sleep(delay + random.uniform(0, delay))
+                delay = min(delay * 2, 30.0)
+        if self.after_upload:
+            self.after_upload(points)
+        with self.lock:
+            self.uploaded += len(points)
+
+    def close(self):
+        """Wait for every queued batch, re-raising the first failure."""
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            # After a failure, drop batches that haven't started
+            for future in self.pending:
+                future.cancel()
+            self.pending.clear()
+            if self.executor:
+                self.executor.shutdown(wait=True)
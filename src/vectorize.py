@@ -5,39 +5,228 @@ Migrate chat messages from SQLite to Qdrant vector database
 """
 
 import argparse
-import sqlite3
-from typing import List, Dict
+import heapq
+import os
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client.models import Distance, VectorParams, PointStruct, PointIdsList
 from sentence_transformers import SentenceTransformer
+import embedding_cache
+import shards
+import vector_pipeline
+from compression import plain_text, reader_codec
+from ingest import connect, ensure_schema
+from vector_mapping import message_point_id
+from vector_pipeline import Uploader, batched, prefetch
 
 
-def load_messages_from_sqlite(db_path: str) -> List[Dict]:
-    """Load all messages from SQLite database."""
-    con = sqlite3.connect(db_path)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
-
-    cur.execute("""
-        SELECT
-            message_id,
-            canonical_thread_id,
-            platform,
-            account_id,
-            ts,
-            role,
-            text,
-            title,
-            source_id
-        FROM messages
-        ORDER BY ts
-    """)
-
-    messages = [dict(row) for row in cur.fetchall()]
+# Rows fetched per keyset page
+PAGE_SIZE = 1000
+
+
+def unmapped_filter(collection_name: Optional[str], catalog: str = "main") -> Tuple[str, List]:
+    """SQL condition (and params) for messages not yet embedded into a collection."""
+    if not collection_name:
+        return "1", []
+    return f"""NOT EXISTS (SELECT 1 FROM {catalog}.qdrant_messages q
+              WHERE q.collection_name = ? AND q.message_id = m.message_id)""", [collection_name]
+
+
+def count_messages(db_path: str, collection_name: Optional[str] = None) -> Dict:
+    """Messages, threads and platforms that load_messages_from_sqlite() will yield, across shards."""
+    con, paths = shards.open_archive(db_path)
+    con.close()
+    counts = {"messages": 0, "threads": 0, "platforms": []}
+    for path in paths:
+        con, catalog = shards.open_shard(db_path, path)
+        where, params = unmapped_filter(collection_name, catalog)
+        messages, threads, platforms = con.execute(f"""
+            SELECT count(*), count(DISTINCT canonical_thread_id), group_concat(DISTINCT platform)
+            FROM messages m WHERE {where}
+        """, params).fetchone()
+        con.close()
+        # A thread never spans shards, so per-shard thread counts add up
+        counts["messages"] += messages
+        counts["threads"] += threads
+        for platform in (platforms.split(",") if platforms else []):
+            if platform not in counts["platforms"]:
+                counts["platforms"].append(platform)
+    return counts
+
+
+def load_shard_messages(db_path: str, path: str, collection_name: Optional[str],
+                        page_size: int) -> Iterator[Dict]:
+    """Stream one shard's messages by keyset (ts, rowid), the order idx_messages_ts already has."""
+    # The generator may be resumed from a prefetch thread
+    con, catalog = shards.open_shard(db_path, path, check_same_thread=False)
+    where, params = unmapped_filter(collection_name, catalog)
+
+    # Compressed archives store text as zstd blobs; decompress on load
+    codec = reader_codec(con)
+    after = None
+    try:
+        while True:
+            keyset = "AND (m.ts, m.rowid) > (?, ?)" if after else ""
+            rows = con.execute(f"""
+                SELECT
+                    m.rowid,
+                    m.message_id,
+                    m.canonical_thread_id,
+                    m.platform,
+                    m.account_id,
+                    m.ts,
+                    m.role,
+                    COALESCE(b.text, m.text) AS text,
+                    m.title,
+                    m.source_id,
+                    b.hash AS body_hash,
+                    -- Bodies carried by several messages only need embedding once
+                    EXISTS (SELECT 1 FROM messages o
+                            WHERE o.body_id = m.body_id AND o.rowid != m.rowid) AS shared
+                FROM messages m
+                LEFT JOIN bodies b ON b.body_id = m.body_id
+                WHERE {where} {keyset}
+                ORDER BY m.ts, m.rowid
+                LIMIT ?
+            """, params + list(after or ()) + [page_size]).fetchall()
+            for row in rows:
+                yield dict(row, text=plain_text(row['text'], codec))
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]['ts'], rows[-1]['rowid'])
+    finally:
+        con.close()
+
+
+def load_messages_from_sqlite(db_path: str, collection_name: Optional[str] = None,
+                              page_size: int = PAGE_SIZE) -> Iterator[Dict]:
+    """
+    Stream messages from SQLite in timestamp order, merged across shards.
+
+    Each shard is read in keyset pages, so memory stays bounded and no
+    read transaction is held between pages. With collection_name, only
+    messages not yet embedded into that collection (per qdrant_messages)
+    are loaded.
+    """
+    con, paths = shards.open_archive(db_path)
+    con.close()
+    return heapq.merge(*(load_shard_messages(db_path, path, collection_name, page_size) for path in paths),
+                       key=lambda m: m['ts'])
+
+
+def encode_batch(encoder, messages: List[Dict], body_vectors: Dict) -> List:
+    """
+    Embed a batch, encoding each shared body only the first time it is seen.
+
+    body_vectors maps a body's hash -> embedding for bodies that several
+    messages reference; it only grows with repeated bodies, not every message.
+    """
+    pending = [m for m in messages if not (m['shared'] and m['body_hash'] in body_vectors)]
+    # Repeats within the batch are encoded once too
+    unique = list({(m['body_hash'] if m['shared'] else id(m)): m for m in pending}.values())
+    encoded = encoder.encode([m['text'] for m in unique]) if unique else []
+
+    vectors = {}
+    for message, embedding in zip(unique, encoded):
+        if message['shared']:
+            body_vectors[message['body_hash']] = embedding
+        else:
+            vectors[id(message)] = embedding
+    return [body_vectors[m['body_hash']] if m['shared'] else vectors[id(m)] for m in messages]
+
+
+def message_point(message: Dict, embedding) -> PointStruct:
+    return PointStruct(
+        id=message_point_id(message['message_id']),
+        vector=embedding.tolist(),
+        payload={
+            "message_id": message['message_id'],
+            "thread_id": message['canonical_thread_id'],
+            "platform": message['platform'],
+            "account_id": message['account_id'],
+            "timestamp": message['ts'],
+            "role": message['role'],
+            "text": message['text'],
+            "title": message['title'],
+            "source_id": message['source_id']
+        }
+    )
+
+
+def save_qdrant_mapping(db_path: str, collection_name: str, model_name: str, mappings: List[tuple]):
+    """
+    Record which messages are embedded in a collection.
+
+    Args:
+        db_path: Path to SQLite database
+        collection_name: Name of Qdrant collection
+        model_name: Embedding model the vectors came from
+        mappings: List of (qdrant_id, message_id) tuples
+    """
+    con = connect(db_path)
+    indexed_at = datetime.now(timezone.utc).isoformat()
+    con.executemany("""
+        INSERT OR REPLACE INTO qdrant_messages
+        (message_id, collection_name, model, qdrant_id, indexed_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(message_id, collection_name, model_name, qdrant_id, indexed_at)
+          for qdrant_id, message_id in mappings])
+    con.commit()
     con.close()
 
-    return messages
+
+def clear_qdrant_mapping(db_path: str, collection_name: str):
+    """Forget every message recorded for a collection (it is being rebuilt)."""
+    con = connect(db_path)
+    con.execute("DELETE FROM qdrant_messages WHERE collection_name = ?", (collection_name,))
+    con.commit()
+    con.close()
+
+
+def mapping_state(db_path: str, collection_name: str) -> Dict:
+    """Models recorded for a collection, and whether it still uses sequential point IDs."""
+    con = connect(db_path)
+    models = [row[0] for row in con.execute(
+        "SELECT DISTINCT model FROM qdrant_messages WHERE collection_name = ?", (collection_name,))]
+    sequential = con.execute("""SELECT EXISTS (SELECT 1 FROM qdrant_messages
+        WHERE collection_name = ? AND qdrant_id NOT LIKE '%-%')""", (collection_name,)).fetchone()[0]
+    con.close()
+    return {"models": models, "sequential": bool(sequential)}
+
+
+def remove_deleted_messages(client: QdrantClient, db_path: str, collection_name: str,
+                            batch_size: int = 1000) -> int:
+    """Delete points whose messages are gone from every shard of the archive; returns how many."""
+    con, paths = shards.open_archive(db_path)
+    con.execute("""CREATE TEMP TABLE stale AS
+        SELECT qdrant_id, message_id FROM qdrant_messages WHERE collection_name = ?""", (collection_name,))
+    for schema in shards.iter_attached(con, paths):
+        con.execute(f"DELETE FROM temp.stale WHERE message_id IN (SELECT message_id FROM {schema}.messages)")
+        # Shards can only be detached outside a transaction
+        con.commit()
+    stale = [tuple(row) for row in con.execute("SELECT qdrant_id, message_id FROM temp.stale")]
+
+    for start in range(0, len(stale), batch_size):
+        batch = stale[start:start + batch_size]
+        client.delete(collection_name=collection_name,
+                      points_selector=PointIdsList(points=[qdrant_id for qdrant_id, _ in batch]))
+        # Forget each batch only once Qdrant has dropped it
+        con.executemany("DELETE FROM qdrant_messages WHERE collection_name = ? AND message_id = ?",
+                        [(collection_name, message_id) for _, message_id in batch])
+        con.commit()
+    con.close()
+    return len(stale)
+
+
+def collection_exists(client: QdrantClient, collection_name: str) -> bool:
+    try:
+        client.get_collection(collection_name=collection_name)
+        return True
+    except Exception:
+        return False
 
 
 def create_qdrant_collection(client: QdrantClient, collection_name: str, vector_size: int):
@@ -58,7 +247,7 @@ def create_qdrant_collection(client: QdrantClient, collection_name: str, vector_
 def main():
     parser = argparse.ArgumentParser(
         description="Migrate chat messages from SQLite to Qdrant vector database",
-        epilog="Example: python vectorize.py --db my_chats.sqlite --collection chat-archive"
+        epilog="Example: python vectorize.py --db my_chats.sqlite --collection chat-archive --incremental"
     )
     parser.add_argument("--db", required=True, help="Path to SQLite database")
     parser.add_argument("--collection", default="chat-messages", help="Qdrant collection name")
@@ -69,33 +258,18 @@ def main():
     parser.add_argument("--batch-size", type=int, default=32,
                        help="Batch size for embeddings and upload")
     parser.add_argument("--limit", type=int, help="Limit number of messages to process (for testing)")
+    parser.add_argument("--incremental", action="store_true",
+                       help="Only embed messages not yet in the collection and remove deleted ones "
+                            "(instead of recreating it)")
+    embedding_cache.add_arguments(parser)
+    vector_pipeline.add_arguments(parser)
 
     args = parser.parse_args()
 
-    print(f"\n[*] Loading messages from SQLite: {args.db}")
-    messages = load_messages_from_sqlite(args.db)
-
-    if not messages:
-        print("[!] No messages found in database")
-        return
-
-    if args.limit:
-        messages = messages[:args.limit]
-        print(f"[*] Limited to {args.limit} messages for testing")
-
-    print(f"[+] Loaded {len(messages)} messages")
-
-    # Show statistics
-    platforms = set(m['platform'] for m in messages)
-    threads = set(m['canonical_thread_id'] for m in messages)
-    print(f"[+] Platforms: {', '.join(platforms)}")
-    print(f"[+] Unique threads: {len(threads)}")
-
-    # Load embedding model
-    print(f"\n[*] Loading embedding model: {args.model}")
-    model = SentenceTransformer(args.model)
-    vector_size = model.get_sentence_embedding_dimension()
-    print(f"[+] Model loaded (embedding dimension: {vector_size})")
+    # Upgrade older archives so the bodies and qdrant_messages tables exist
+    if not os.path.exists(args.db):
+        raise SystemExit(f"[ERROR] Database not found: {args.db}")
+    ensure_schema(args.db)
 
     # Connect to Qdrant
     print(f"\n[*] Connecting to Qdrant at {args.host}:{args.port}")
@@ -109,86 +283,97 @@ def main():
         print(f"[!] Failed to connect to Qdrant: {e}")
         return
 
+    # Incremental runs extend the collection when the mapping can be trusted
+    incremental = args.incremental and collection_exists(client, args.collection)
+    state = mapping_state(args.db, args.collection)
+    if incremental:
+        if any(model != args.model for model in state["models"]):
+            raise SystemExit(f"[ERROR] {args.collection} was built with {', '.join(state['models'])}; "
+                             f"run without --incremental to rebuild it with {args.model}")
+        if not state["models"] and client.get_collection(collection_name=args.collection).points_count:
+            print(f"[*] {args.collection} has no message mapping yet; rebuilding it")
+            incremental = False
+        elif state["sequential"]:
+            print(f"[*] {args.collection} was built with sequential point IDs; rebuilding it")
+            incremental = False
+    elif args.incremental:
+        print(f"[*] Collection {args.collection} does not exist yet; embedding every message")
+
+    if incremental:
+        removed = remove_deleted_messages(client, args.db, args.collection)
+        if removed:
+            print(f"[+] Removed {removed} points for messages no longer in the archive")
+
+    print(f"\n[*] Reading messages from SQLite: {args.db}")
+    collection_filter = args.collection if incremental else None
+    stats = count_messages(args.db, collection_filter)
+
+    if not stats["messages"]:
+        print("[+] Collection is up to date" if incremental else "[!] No messages found in database")
+        return
+
+    print(f"[+] Found {stats['messages']} {'new ' if incremental else ''}messages")
+    print(f"[+] Platforms: {', '.join(stats['platforms'])}")
+    print(f"[+] Unique threads: {stats['threads']}")
+
+    # Messages are streamed page by page while the run proceeds
+    messages = load_messages_from_sqlite(args.db, collection_filter)
+    total = stats["messages"]
+    if args.limit:
+        messages = islice(messages, args.limit)
+        total = min(total, args.limit)
+        print(f"[*] Limited to {args.limit} messages for testing")
+
+    # The model is only loaded once a text is missing from the embedding cache
+    def load_model():
+        print(f"\n[*] Loading embedding model: {args.model}")
+        model = SentenceTransformer(args.model)
+        print(f"[+] Model loaded (embedding dimension: {model.get_sentence_embedding_dimension()})")
+        return model
+
+    encoder = embedding_cache.open_encoder(args, args.db, load_model)
+    vector_size = encoder.dimension()
+
     # Create collection
-    create_qdrant_collection(client, args.collection, vector_size)
+    if not incremental:
+        create_qdrant_collection(client, args.collection, vector_size)
+        clear_qdrant_mapping(args.db, args.collection)
 
-    # Process messages in batches
+    # Read, encode and upload overlap: batches are read ahead on one thread and
+    # uploaded on others while the next batch is being encoded
     print(f"\n[*] Generating embeddings and uploading to Qdrant...")
 
-    batch_texts = []
-    batch_messages = []
-    points = []
-    uploaded = 0
-
-    for msg in tqdm(messages, desc="Processing messages"):
-        batch_texts.append(msg['text'])
-        batch_messages.append(msg)
-
-        # Process batch when full
-        if len(batch_texts) >= args.batch_size:
-            # Generate embeddings
-            embeddings = model.encode(batch_texts, show_progress_bar=False)
-
-            # Create points
-            for i, (text, embedding, message) in enumerate(zip(batch_texts, embeddings, batch_messages)):
-                point = PointStruct(
-                    id=uploaded + i,
-                    vector=embedding.tolist(),
-                    payload={
-                        "message_id": message['message_id'],
-                        "thread_id": message['canonical_thread_id'],
-                        "platform": message['platform'],
-                        "account_id": message['account_id'],
-                        "timestamp": message['ts'],
-                        "role": message['role'],
-                        "text": message['text'],
-                        "title": message['title'],
-                        "source_id": message['source_id']
-                    }
-                )
-                points.append(point)
-
-            # Upload batch
-            client.upsert(collection_name=args.collection, points=points)
-            uploaded += len(points)
-
-            # Reset batch
-            batch_texts = []
-            batch_messages = []
-            points = []
-
-    # Process remaining messages
-    if batch_texts:
-        embeddings = model.encode(batch_texts, show_progress_bar=False)
-
-        for i, (text, embedding, message) in enumerate(zip(batch_texts, embeddings, batch_messages)):
-            point = PointStruct(
-                id=uploaded + i,
-                vector=embedding.tolist(),
-                payload={
-                    "message_id": message['message_id'],
-                    "thread_id": message['canonical_thread_id'],
-                    "platform": message['platform'],
-                    "account_id": message['account_id'],
-                    "timestamp": message['ts'],
-                    "role": message['role'],
-                    "text": message['text'],
-                    "title": message['title'],
-                    "source_id": message['source_id']
-                }
-            )
-            points.append(point)
-
-        client.upsert(collection_name=args.collection, points=points)
-        uploaded += len(points)
+    body_vectors = {}
+    uploader = Uploader(client, args.collection, args.in_flight, args.upload_retries,
+                        after_upload=lambda points: save_qdrant_mapping(
+                            args.db, args.collection, args.model,
+                            [(p.id, p.payload['message_id']) for p in points]))
+
+    with tqdm(total=total, desc="Processing messages") as progress:
+        try:
+            for batch in prefetch(batched(messages, args.batch_size)):
+                embeddings = encode_batch(encoder, batch, body_vectors)
+                uploader.submit([message_point(message, embedding)
+                                 for message, embedding in zip(batch, embeddings)])
+                progress.update(len(batch))
+        finally:
+            uploader.close()
+            encoder.close()
+    uploaded = uploader.uploaded
 
     # Verify upload
     collection_info = client.get_collection(collection_name=args.collection)
 
     print(f"\n[+] Migration complete!")
     print(f"  Messages uploaded: {uploaded}")
+    if body_vectors:
+        print(f"  Shared bodies embedded once: {len(body_vectors)}")
+    print(f"  {encoder.summary()}")
+    if uploader.retried:
+        print(f"  Upserts retried: {uploader.retried}")
     print(f"  Collection: {args.collection}")
     print(f"  Points in collection: {collection_info.points_count}")
+    print(f"  Message mappings stored in SQLite: qdrant_messages table")
     print(f"  Qdrant URL: http://{args.host}:{args.port}/dashboard")
 
 
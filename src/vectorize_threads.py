@@ -6,68 +6,138 @@ Each vector represents an entire conversation thread
 """
 
 import argparse
-import sqlite3
-from typing import List, Dict
-from datetime import datetime
-from collections import defaultdict
+import heapq
+import os
+import re
+from datetime import datetime, timezone
+from itertools import chain, islice
+from typing import Dict, Iterator, List, Tuple
+import numpy as np
 from tqdm import tqdm
 from qdrant_client import QdrantClient
 from qdrant_client.models import Distance, VectorParams, PointStruct
 from sentence_transformers import SentenceTransformer
+import embedding_cache
+import shards
+import vector_pipeline
+from compression import plain_text, reader_codec
+from ingest import connect, ensure_schema
+from vector_mapping import chunk_point_id, thread_point_id
+from vector_pipeline import Uploader, batched, prefetch
+
+
+# Message rows fetched per keyset page
+PAGE_SIZE = 1000
+
+DEFAULT_CHUNK_OVERLAP = 32
+# Room for the [CLS]/[SEP] tokens the model adds around each chunk
+SPECIAL_TOKENS = 2
+
+
+def count_threads(db_path: str) -> Dict:
+    """Threads, messages and platforms that load_threads_from_sqlite() will yield, across shards."""
+    con, paths = shards.open_archive(db_path)
+    counts = {"threads": 0, "messages": 0, "platforms": []}
+    for schema in shards.iter_attached(con, paths):
+        threads, messages, platforms = con.execute(f"""
+            SELECT count(DISTINCT canonical_thread_id), count(*), group_concat(DISTINCT platform)
+            FROM {schema}.messages
+        """).fetchone()
+        # A thread never spans shards, so per-shard thread counts add up
+        counts["threads"] += threads
+        counts["messages"] += messages
+        for platform in (platforms.split(",") if platforms else []):
+            if platform not in counts["platforms"]:
+                counts["platforms"].append(platform)
+    con.close()
+    return counts
+
+
+def make_thread(thread_id: str, messages: List[Dict]) -> Dict:
+    """Thread data with metadata taken from its first and last message."""
+    first = messages[0]
+    return {
+        "messages": messages,
+        "metadata": {
+            "thread_id": thread_id,
+            "platform": first['platform'],
+            "account_id": first['account_id'],
+            "title": first['title'],
+            "source_id": first['source_id'],
+            "first_timestamp": first['ts'],
+            "last_timestamp": messages[-1]['ts'],
+            "message_count": len(messages),
+        },
+    }
+
+
+def load_threads_from_sqlite(db_path: str, page_size: int = PAGE_SIZE) -> Iterator[Tuple[str, Dict]]:
+    """
+    Stream (thread_id, thread data) pairs in canonical_thread_id order, merged across shards.
 
-
-def load_threads_from_sqlite(db_path: str) -> Dict[str, Dict]:
-    """Load all messages grouped by thread."""
-    con = sqlite3.connect(db_path)
-    con.row_factory = sqlite3.Row
-    cur = con.cursor()
-
-    cur.execute("""
-        SELECT
-            message_id,
-            canonical_thread_id,
-            platform,
-            account_id,
-            ts,
-            role,
-            text,
-            title,
-            source_id
-        FROM messages
-        ORDER BY canonical_thread_id, ts
-    """)
-
-    # Group messages by thread
-    threads = defaultdict(lambda: {
-        "messages": [],
-        "metadata": {}
-    })
-
-    for row in cur.fetchall():
-        thread_id = row['canonical_thread_id']
-        message = dict(row)
-
-        threads[thread_id]["messages"].append(message)
-
-        # Store thread metadata from first message
-        if not threads[thread_id]["metadata"]:
-            threads[thread_id]["metadata"] = {
-                "thread_id": thread_id,
-                "platform": row['platform'],
-                "account_id": row['account_id'],
-                "title": row['title'],
-                "source_id": row['source_id'],
-                "first_timestamp": row['ts'],
-            }
-
+    Memory is bounded by one page per shard plus the longest thread.
+    """
+    con, paths = shards.open_archive(db_path)
     con.close()
+    return heapq.merge(*(load_shard_threads(db_path, path, page_size) for path in paths),
+                       key=lambda item: item[0])
+
 
-    # Add last timestamp and message count
-    for thread_id, thread_data in threads.items():
-        thread_data["metadata"]["last_timestamp"] = thread_data["messages"][-1]['ts']
-        thread_data["metadata"]["message_count"] = len(thread_data["messages"])
+def load_shard_threads(db_path: str, path: str, page_size: int) -> Iterator[Tuple[str, Dict]]:
+    """
+    Stream one shard's threads.
 
-    return dict(threads)
+    Messages are read in pages by keyset (canonical_thread_id, ts, rowid),
+    the order of idx_messages_thread_ts, and a thread is yielded as soon as
+    the cursor moves past it.
+    """
+    # The generator may be resumed from a prefetch thread
+    con, _ = shards.open_shard(db_path, path, check_same_thread=False)
+
+    # Compressed archives store text as zstd blobs; decompress on load
+    codec = reader_codec(con)
+    after = None
+    thread_id = None
+    messages = []
+    try:
+        while True:
+            keyset = "WHERE (m.canonical_thread_id, m.ts, m.rowid) > (?, ?, ?)" if after else ""
+            rows = con.execute(f"""
+                SELECT
+                    m.rowid,
+                    m.message_id,
+                    m.canonical_thread_id,
+                    m.platform,
+                    m.account_id,
+                    m.ts,
+                    m.role,
+                    COALESCE(b.text, m.text) AS text,
+                    m.title,
+                    m.source_id
+                FROM messages m
+                LEFT JOIN bodies b ON b.body_id = m.body_id
+                {keyset}
+                ORDER BY m.canonical_thread_id, m.ts, m.rowid
+                LIMIT ?
+            """, list(after or ()) + [page_size]).fetchall()
+
+            for row in rows:
+                if row['canonical_thread_id'] != thread_id:
+                    if messages:
+                        yield thread_id, make_thread(thread_id, messages)
+                    thread_id = row['canonical_thread_id']
+                    messages = []
+                messages.append(dict(row, text=plain_text(row['text'], codec)))
+
+            if len(rows) < page_size:
+                break
+            last = rows[-1]
+            after = (last['canonical_thread_id'], last['ts'], last['rowid'])
+    finally:
+        con.close()
+
+    if messages:
+        yield thread_id, make_thread(thread_id, messages)
 
 
 def thread_to_text(thread_data: Dict) -> str:
@@ -86,21 +156,78 @@ def thread_to_text(thread_data: Dict) -> str:
     return "\n".join(text_parts)
 
 
-def ensure_mapping_table(db_path: str):
-    """Ensure the qdrant_threads mapping table exists."""
-    con = sqlite3.connect(db_path)
-    cur = con.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS qdrant_threads (
-            qdrant_id INTEGER PRIMARY KEY,
-            canonical_thread_id TEXT NOT NULL,
-            collection_name TEXT NOT NULL,
-            indexed_at TEXT NOT NULL,
-            UNIQUE(canonical_thread_id, collection_name)
-        )
-    """)
-    con.commit()
-    con.close()
+def token_spans(tokenizer, text: str) -> List[Tuple[int, int]]:
+    """Character (start, end) of each token of text, without special tokens."""
+    try:
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        return [(start, end) for start, end in offsets if end > start]
+    except (NotImplementedError, TypeError, KeyError):
+        # Slow tokenizers have no offsets; approximate tokens with words
+        return [m.span() for m in re.finditer(r"\S+", text)]
+
+
+def chunk_windows(text: str, spans: List[Tuple[int, int]], size: int, overlap: int) -> List[Tuple[int, int]]:
+    """(start_char, end_char) windows of at most size tokens, each overlapping the previous one."""
+    if len(spans) <= size:
+        return [(0, len(text))]
+    windows = []
+    for start in range(0, len(spans), size - overlap):
+        end = min(start + size, len(spans))
+        windows.append((spans[start][0] if start else 0, spans[end - 1][1]))
+        if end == len(spans):
+            break
+    return windows
+
+
+def chunk_points(encoder, batch: List[Tuple], size: int, overlap: int) -> Tuple[List, List]:
+    """
+    Embed a batch of (thread_id, metadata, text) chunk by chunk.
+
+    Returns (thread points, chunk points). A thread's point carries the
+    normalized mean of its chunk vectors, so thread-level search covers
+    the whole conversation instead of its first few hundred tokens.
+    """
+    tokenizer = encoder.model.tokenizer
+    windows = [chunk_windows(text, token_spans(tokenizer, text), size, overlap) for _, _, text in batch]
+    vectors = encoder.encode([text[start:end] for (_, _, text), spans in zip(batch, windows)
+                              for start, end in spans])
+
+    threads, chunks = [], []
+    offset = 0
+    for (thread_id, metadata, text), spans in zip(batch, windows):
+        own = vectors[offset:offset + len(spans)]
+        offset += len(spans)
+        pooled = own.mean(axis=0)
+        pooled = pooled / (np.linalg.norm(pooled) or 1.0)
+        threads.append(thread_point(thread_id, dict(metadata, chunk_count=len(spans)), text, pooled))
+        for index, ((start, end), vector) in enumerate(zip(spans, own)):
+            chunks.append(PointStruct(
+                id=chunk_point_id(thread_id, index),
+                vector=vector.tolist(),
+                payload={
+                    **metadata,
+                    "chunk_index": index,
+                    "chunk_count": len(spans),
+                    "start_char": start,
+                    "end_char": end,
+                    "text": text[start:end],
+                }
+            ))
+    return threads, chunks
+
+
+def thread_point(thread_id: str, metadata: Dict, text: str, embedding) -> PointStruct:
+    # Store first 500 chars of conversation as preview
+    preview = text[:500] + ("..." if len(text) > 500 else "")
+    return PointStruct(
+        id=thread_point_id(thread_id),
+        vector=embedding.tolist(),
+        payload={
+            **metadata,
+            "preview": preview,
+            "full_text": text[:10000],  # Store up to 10k chars
+        }
+    )
 
 
 def save_qdrant_mapping(db_path: str, collection_name: str, mappings: List[tuple]):
@@ -112,10 +239,10 @@ def save_qdrant_mapping(db_path: str, collection_name: str, mappings: List[tuple
         collection_name: Name of Qdrant collection
         mappings: List of (qdrant_id, canonical_thread_id) tuples
     """
-    con = sqlite3.connect(db_path)
+    con = connect(db_path)
     cur = con.cursor()
 
-    indexed_at = datetime.utcnow().isoformat()
+    indexed_at = datetime.now(timezone.utc).isoformat()
 
     for qdrant_id, thread_id in mappings:
         cur.execute("""
@@ -128,6 +255,29 @@ def save_qdrant_mapping(db_path: str, collection_name: str, mappings: List[tuple
     con.close()
 
 
+def save_chunk_mapping(db_path: str, collection_name: str, points: List[PointStruct]):
+    """Record which thread (and which characters of it) each chunk point holds."""
+    con = connect(db_path)
+    indexed_at = datetime.now(timezone.utc).isoformat()
+    con.executemany("""
+        INSERT OR REPLACE INTO qdrant_chunks
+        (qdrant_id, canonical_thread_id, chunk_index, start_char, end_char, collection_name, indexed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(p.id, p.payload['thread_id'], p.payload['chunk_index'], p.payload['start_char'],
+           p.payload['end_char'], collection_name, indexed_at) for p in points])
+    con.commit()
+    con.close()
+
+
+def clear_qdrant_mapping(db_path: str, collection_name: str):
+    """Forget every thread and chunk recorded for a collection (it is being rebuilt)."""
+    con = connect(db_path)
+    con.execute("DELETE FROM qdrant_threads WHERE collection_name = ?", (collection_name,))
+    con.execute("DELETE FROM qdrant_chunks WHERE collection_name = ?", (collection_name,))
+    con.commit()
+    con.close()
+
+
 def create_qdrant_collection(client: QdrantClient, collection_name: str, vector_size: int):
     """Create or recreate Qdrant collection."""
     try:
@@ -157,45 +307,75 @@ def main():
     parser.add_argument("--batch-size", type=int, default=8,
                        help="Batch size for embeddings")
     parser.add_argument("--limit", type=int, help="Limit number of threads (for testing)")
+    parser.add_argument("--chunk", action="store_true",
+                       help="Embed every thread in overlapping token windows instead of truncating it "
+                            "(chunk points go to a second collection; thread points get the pooled vector)")
+    parser.add_argument("--chunk-tokens", dest="chunk_tokens", type=int,
+                       help="Tokens per chunk (default: the model's maximum sequence length)")
+    parser.add_argument("--chunk-overlap", dest="chunk_overlap", type=int,
+                       help=f"Tokens shared by consecutive chunks "
+                            f"(default: {DEFAULT_CHUNK_OVERLAP}, at most a quarter of a chunk)")
+    parser.add_argument("--chunk-collection", dest="chunk_collection",
+                       help="Qdrant collection for chunk points (default: <collection>-chunks)")
+    embedding_cache.add_arguments(parser)
+    vector_pipeline.add_arguments(parser)
 
     args = parser.parse_args()
+    chunk_collection = args.chunk_collection or f"{args.collection}-chunks"
+    if args.chunk_tokens is not None and args.chunk_tokens <= (args.chunk_overlap or 0):
+        parser.error("--chunk-tokens must be larger than --chunk-overlap")
 
-    # Ensure mapping table exists
-    ensure_mapping_table(args.db)
+    # Upgrade older archives so the bodies and qdrant_threads tables exist
+    if not os.path.exists(args.db):
+        raise SystemExit(f"[ERROR] Database not found: {args.db}")
+    ensure_schema(args.db)
 
-    print(f"\n[*] Loading threads from SQLite: {args.db}")
-    threads = load_threads_from_sqlite(args.db)
+    print(f"\n[*] Reading threads from SQLite: {args.db}")
+    stats = count_threads(args.db)
 
-    if not threads:
+    if not stats["threads"]:
         print("[!] No threads found in database")
         return
 
-    thread_list = list(threads.items())
+    print(f"[+] Found {stats['threads']} threads")
+    print(f"[+] Total messages: {stats['messages']}")
+    print(f"[+] Platforms: {', '.join(stats['platforms'])}")
 
+    # Threads are streamed page by page while the run proceeds
+    threads = load_threads_from_sqlite(args.db)
+    total = stats["threads"]
     if args.limit:
-        thread_list = thread_list[:args.limit]
+        threads = islice(threads, args.limit)
+        total = min(total, args.limit)
         print(f"[*] Limited to {args.limit} threads for testing")
 
-    print(f"[+] Loaded {len(thread_list)} threads")
-
-    # Show statistics
-    total_messages = sum(t[1]["metadata"]["message_count"] for t in thread_list)
-    platforms = set(t[1]["metadata"]["platform"] for t in thread_list)
-    print(f"[+] Total messages: {total_messages}")
-    print(f"[+] Platforms: {', '.join(platforms)}")
-
     # Sample thread
-    sample_thread_id, sample_thread = thread_list[0]
+    sample_thread_id, sample_thread = next(threads)
+    threads = chain([(sample_thread_id, sample_thread)], threads)
     print(f"\n[*] Sample thread:")
     print(f"  Title: {sample_thread['metadata']['title']}")
     print(f"  Messages: {sample_thread['metadata']['message_count']}")
     print(f"  Platform: {sample_thread['metadata']['platform']}")
 
-    # Load embedding model
-    print(f"\n[*] Loading embedding model: {args.model}")
-    model = SentenceTransformer(args.model)
-    vector_size = model.get_sentence_embedding_dimension()
-    print(f"[+] Model loaded (embedding dimension: {vector_size})")
+    # The model is only loaded once a thread is missing from the embedding cache
+    def load_model():
+        print(f"\n[*] Loading embedding model: {args.model}")
+        model = SentenceTransformer(args.model)
+        print(f"[+] Model loaded (embedding dimension: {model.get_sentence_embedding_dimension()})")
+        return model
+
+    encoder = embedding_cache.open_encoder(args, args.db, load_model)
+    vector_size = encoder.dimension()
+
+    if args.chunk:
+        # Chunk windows follow the model's own tokenizer and sequence limit
+        chunk_tokens = args.chunk_tokens or encoder.model.max_seq_length - SPECIAL_TOKENS
+        chunk_overlap = args.chunk_overlap
+        if chunk_overlap is None:
+            chunk_overlap = min(DEFAULT_CHUNK_OVERLAP, chunk_tokens // 4)
+        if chunk_tokens <= chunk_overlap:
+            raise SystemExit(f"[ERROR] {args.model} fits {chunk_tokens} tokens per chunk; "
+                             f"use a smaller --chunk-overlap")
 
     # Connect to Qdrant
     print(f"\n[*] Connecting to Qdrant at {args.host}:{args.port}")
@@ -210,105 +390,66 @@ def main():
 
     # Create collection
     create_qdrant_collection(client, args.collection, vector_size)
-
-    # Process threads in batches
+    clear_qdrant_mapping(args.db, args.collection)
+
+    chunk_uploader = None
+    if args.chunk:
+        print(f"[*] Chunking threads into {chunk_tokens}-token windows overlapping by {chunk_overlap}")
+        create_qdrant_collection(client, chunk_collection, vector_size)
+        clear_qdrant_mapping(args.db, chunk_collection)
+        chunk_uploader = Uploader(client, chunk_collection, args.in_flight, args.upload_retries,
+                                  after_upload=lambda points: save_chunk_mapping(args.db, chunk_collection, points))
+
+    # Read, encode and upload overlap: thread texts are built ahead on one
+    # thread and uploaded on others while the next batch is being encoded
     print(f"\n[*] Generating thread embeddings and uploading to Qdrant...")
 
-    batch_texts = []
-    batch_thread_ids = []
-    batch_metadata = []
-    points = []
-    uploaded = 0
-    all_mappings = []  # Track (qdrant_id, thread_id) mappings
-
-    for thread_id, thread_data in tqdm(thread_list, desc="Processing threads"):
-        # Convert thread to text
-        thread_text = thread_to_text(thread_data)
-        batch_texts.append(thread_text)
-        batch_thread_ids.append(thread_id)
-        batch_metadata.append(thread_data["metadata"])
-
-        # Process batch when full
-        if len(batch_texts) >= args.batch_size:
-            # Generate embeddings
-            embeddings = model.encode(batch_texts, show_progress_bar=False)
-
-            # Create points
-            for i, (thread_id, embedding, metadata, text) in enumerate(
-                zip(batch_thread_ids, embeddings, batch_metadata, batch_texts)
-            ):
-                # Store first 500 chars of conversation as preview
-                preview = text[:500] + ("..." if len(text) > 500 else "")
-
-                qdrant_id = uploaded + i
-
-                point = PointStruct(
-                    id=qdrant_id,
-                    vector=embedding.tolist(),
-                    payload={
-                        **metadata,
-                        "preview": preview,
-                        "full_text": text[:10000],  # Store up to 10k chars
-                    }
-                )
-                points.append(point)
-
-                # Track mapping for SQLite
-                all_mappings.append((qdrant_id, thread_id))
-
-            # Upload batch
-            client.upsert(collection_name=args.collection, points=points)
-            uploaded += len(points)
-
-            # Reset batch
-            batch_texts = []
-            batch_thread_ids = []
-            batch_metadata = []
-            points = []
-
-    # Process remaining threads
-    if batch_texts:
-        embeddings = model.encode(batch_texts, show_progress_bar=False)
-
-        for i, (thread_id, embedding, metadata, text) in enumerate(
-            zip(batch_thread_ids, embeddings, batch_metadata, batch_texts)
-        ):
-            preview = text[:500] + ("..." if len(text) > 500 else "")
-
-            qdrant_id = uploaded + i
-
-            point = PointStruct(
-                id=qdrant_id,
-                vector=embedding.tolist(),
-                payload={
-                    **metadata,
-                    "preview": preview,
-                    "full_text": text[:10000],
-                }
-            )
-            points.append(point)
-
-            # Track mapping for SQLite
-            all_mappings.append((qdrant_id, thread_id))
-
-        client.upsert(collection_name=args.collection, points=points)
-        uploaded += len(points)
-
-    # Save mappings to SQLite
-    print(f"\n[*] Saving Qdrant ID mappings to SQLite...")
-    save_qdrant_mapping(args.db, args.collection, all_mappings)
-    print(f"[+] Saved {len(all_mappings)} mappings to qdrant_threads table")
+    uploader = Uploader(client, args.collection, args.in_flight, args.upload_retries,
+                        after_upload=lambda points: save_qdrant_mapping(
+                            args.db, args.collection, [(p.id, p.payload['thread_id']) for p in points]))
+    texts = ((thread_id, thread_data["metadata"], thread_to_text(thread_data))
+             for thread_id, thread_data in threads)
+
+    with tqdm(total=total, desc="Processing threads") as progress:
+        try:
+            for batch in prefetch(batched(texts, args.batch_size)):
+                if chunk_uploader:
+                    points, chunks = chunk_points(encoder, batch, chunk_tokens, chunk_overlap)
+                    chunk_uploader.submit(chunks)
+                else:
+                    embeddings = encoder.encode([text for _, _, text in batch])
+                    points = [thread_point(thread_id, metadata, text, embedding)
+                              for (thread_id, metadata, text), embedding in zip(batch, embeddings)]
+                uploader.submit(points)
+                progress.update(len(batch))
+        finally:
+            try:
+                uploader.close()
+            finally:
+                if chunk_uploader:
+                    chunk_uploader.close()
+                encoder.close()
+    uploaded = uploader.uploaded
 
     # Verify upload
     collection_info = client.get_collection(collection_name=args.collection)
 
     print(f"\n[+] Migration complete!")
     print(f"  Threads uploaded: {uploaded}")
+    if chunk_uploader:
+        print(f"  Chunks uploaded: {chunk_uploader.uploaded} (collection {chunk_collection})")
+    print(f"  {encoder.summary()}")
+    retried = uploader.retried + (chunk_uploader.retried if chunk_uploader else 0)
+    if retried:
+        print(f"  Upserts retried: {retried}")
     print(f"  Collection: {args.collection}")
     print(f"  Points in collection: {collection_info.points_count}")
     print(f"  Qdrant URL: http://{args.host}:{args.port}/dashboard")
     print(f"\n[*] Each vector represents an entire conversation thread")
-    print(f"[*] Qdrant ID mappings stored in SQLite: qdrant_threads table")
+    if chunk_uploader:
+        print(f"[*] Chunk vectors in {chunk_collection} hold windows of each thread; "
+              f"search them with query_threads.py --chunks")
+    print(f"[*] Qdrant ID mappings stored in SQLite: qdrant_threads{' and qdrant_chunks' if chunk_uploader else ''} tables")
 
 
 if __name__ == "__main__":